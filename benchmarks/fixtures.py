@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Generation of synthetic .nif files, shaped like BodySlide outputs : a root NiNode with extra data, a few NiNode
+# levels, and NiTriShape blocks with a BSLightingShaderProperty each
+import os
+import random
+
+from pyffi.formats.nif import NifFormat
+
+KEYWORDS = [b"BaseShape", b"Body", b"Hands", b"Feet"]
+
+# name : (number of files out of 10, number of shapes, number of nested nodes, vertices per shape)
+PROFILES = {
+    "small": (5, 1, 0, 100),
+    "medium": (3, 4, 4, 1000),
+    "large": (1, 8, 16, 8000),
+    "other": (1, 2, 2, 500),  # no keyword : ignored when scanning
+}
+
+
+def generate_nif(path, names, nodes=0, vertices=100, user_version_2=83, glossiness=30.0, specular_strength=1.0):
+    """
+    Write a Skyrim .nif file
+    :param names: names of the NiTriShape blocks, each with its own BSLightingShaderProperty
+    :param nodes: number of NiNode blocks between the root and the shapes
+    :param vertices: number of vertices of each shape
+    """
+    data = NifFormat.Data(version=0x14020007, user_version=12, user_version_2=user_version_2)
+    data.header.endian_type = 1
+    root = NifFormat.NiNode()
+    root.name = b"Scene Root"
+    extra_data = NifFormat.NiStringExtraData()
+    extra_data.name = b"BODYTRI"
+    extra_data.string_data = b"body.tri"
+    root.add_extra_data(extra_data)
+
+    parent = root
+    for index in range(nodes):
+        node = NifFormat.NiNode()
+        node.name = ("Node" + str(index)).encode("ascii")
+        parent.add_child(node)
+        parent = node
+
+    for name in names:
+        shape_data = NifFormat.NiTriShapeData()
+        shape_data.num_vertices = vertices
+        shape_data.has_vertices = True
+        shape_data.vertices.update_size()
+        for vertex in shape_data.vertices:
+            vertex.x, vertex.y, vertex.z = random.random(), random.random(), random.random()
+        shape_data.has_normals = True
+        shape_data.normals.update_size()
+        shape_data.num_triangles = vertices // 3
+        shape_data.num_triangle_points = shape_data.num_triangles * 3
+        shape_data.has_triangles = True
+        shape_data.triangles.update_size()
+
+        texture_set = NifFormat.BSShaderTextureSet()
+        texture_set.num_textures = 9
+        texture_set.textures.update_size()
+        shader = NifFormat.BSLightingShaderProperty()
+        shader.skyrim_shader_type = 5
+        shader.glossiness = glossiness
+        shader.specular_strength = specular_strength
+        shader.texture_set = texture_set
+
+        shape = NifFormat.NiTriShape()
+        shape.name = name
+        shape.data = shape_data
+        shape.bs_properties[0] = shader
+        shape.bs_properties[1] = NifFormat.NiAlphaProperty()
+        parent.add_child(shape)
+
+    data.roots = [root]
+    with open(path, "wb") as stream:
+        data.write(stream)
+
+
+def generate_fixtures(folder, count, seed=0):
+    """
+    Write count files in folder, mixing every profile. Each generated file is copied rather than generated again,
+    since generating with pyffi is much slower than any backend.
+    :return: dict profile name -> number of files
+    """
+    random.seed(seed)
+    os.makedirs(folder, exist_ok=True)
+    profiles = [name for name, (weight, shapes, nodes, vertices) in sorted(PROFILES.items()) for _ in range(weight)]
+    templates = {}
+    counts = {}
+    for index in range(count):
+        name = profiles[index % len(profiles)]
+        if name not in templates:
+            weight, shapes, nodes, vertices = PROFILES[name]
+            names = [b"Shape" + str(shape).encode("ascii") for shape in range(shapes)] if name == "other" \
+                else [KEYWORDS[shape % len(KEYWORDS)] for shape in range(shapes)]
+            template = os.path.join(folder, name + ".nif")
+            generate_nif(template, names, nodes, vertices, user_version_2=random.choice((83, 100)))
+            with open(template, "rb") as stream:
+                templates[name] = stream.read()
+            os.remove(template)
+
+        # A few levels of sub folders, as in a mod
+        directory = os.path.join(folder, name, str(index // 100))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, name + "_" + str(index) + ".nif"), "wb") as stream:
+            stream.write(templates[name])
+        counts[name] = counts.get(name, 0) + 1
+    return counts
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Throughput of scan and apply backends on generated files. Run from the root of the repository :
+#   python -m benchmarks.run --files 1000
+# Each benchmark runs in its own process, so that peak memory usages do not hide each other. Benchmarks parsing whole
+# files with pyffi take minutes for a few hundred files.
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import KEYWORDS, generate_fixtures
+
+SCAN_BENCHMARKS = ["scan-pyffi", "scan", "scan-cached"]
+APPLY_BENCHMARKS = ["apply-pyffi", "apply-fast", "apply-thread", "apply-process"]
+GLOSSINESS = 500.0
+SPECULAR_STRENGTH = 5.0
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss():
+    """
+    :return: tuple (peak RSS of this process, peak RSS of its biggest child process) in bytes, None if unknown
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None, None
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def measure(name, folder):
+    """
+    Run one benchmark on folder, in this process
+    :return: dict of results
+    """
+    from src.nif.processing import process_nif_file, process_nif_file_pyffi
+    from src.nif.rules import RuleSet
+    from src.nif.scan import _inspect_pyffi, find_nif_files, scan_folder
+    from src.utils.process_pool import process_files
+    from src.utils.scan_cache import ScanCache
+    from src.utils import status
+    from src.utils.scheduler import process_files_in_threads
+
+    paths = [path for path, entry in find_nif_files(folder)]
+    indexes = {}
+    if name.startswith("apply"):
+        entries = [(path, entry) for path, entry in scan_folder(folder, KEYWORDS) if entry.result()]
+        paths = [path for path, entry in entries]
+        indexes = {path: entry.nif_index for path, entry in entries if entry.nif_index is not None}
+    jobs = list(enumerate(paths))
+    rules = RuleSet.from_values(GLOSSINESS, SPECULAR_STRENGTH)
+    cache = None
+    if name == "scan-cached":
+        cache = ScanCache(os.path.join(folder, "scan.db"))
+        for _ in scan_folder(folder, KEYWORDS, cache=cache):
+            pass
+
+    start = time.perf_counter()
+    if name == "scan-pyffi":
+        results = [_inspect_pyffi(path, KEYWORDS).result() for path in paths]
+    elif name.startswith("scan"):
+        results = [entry.result() for path, entry in scan_folder(folder, KEYWORDS, cache=cache)]
+    elif name == "apply-pyffi":
+        results = [process_nif_file_pyffi(path, KEYWORDS, rules) for path in paths]
+    elif name == "apply-fast":
+        results = [process_nif_file(path, KEYWORDS, rules, indexes.get(path)) for path in paths]
+    else:
+        process = process_files_in_threads if name == "apply-thread" else process_files
+        results = [result for index, result in process(jobs, KEYWORDS, rules, indexes=indexes)
+                   if result is not None]
+    seconds = time.perf_counter() - start
+
+    if cache is not None:
+        cache.close()
+    rss, children_rss = peak_rss()
+    # Scan results are True for relevant files, apply results are statuses
+    ok = sum(1 for result in results if result in (True, status.DONE, status.UNCHANGED))
+    return {"name": name, "files": len(paths), "bytes": sum(os.path.getsize(path) for path in paths),
+            "seconds": seconds, "ok": ok, "peak_rss": rss, "peak_rss_children": children_rss}
+
+
+def run(name, folder):
+    """
+    Run one benchmark in a new process, from folder so that htool.ini and htool.log are not created in the repository
+    """
+    env = dict(os.environ, PYTHONPATH=REPOSITORY)
+    output = subprocess.run([sys.executable, "-m", "benchmarks.run", "--measure", name, folder], cwd=folder, env=env,
+                            stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def _megabytes(size):
+    return "n/a" if size is None else "%.1f" % (size / 1024 / 1024)
+
+
+def print_results(results):
+    print("%-14s %7s %9s %10s %8s %10s %12s" % ("benchmark", "files", "seconds", "files/s", "MB/s", "peak MB",
+                                                "children MB"))
+    for result in results:
+        seconds = max(result["seconds"], 1e-9)
+        print("%-14s %7d %9.3f %10.1f %8.1f %10s %12s" % (result["name"], result["files"], result["seconds"],
+                                                         result["files"] / seconds,
+                                                         result["bytes"] / 1024 / 1024 / seconds,
+                                                         _megabytes(result["peak_rss"]),
+                                                         _megabytes(result["peak_rss_children"])))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="benchmarks.run", description="Time scan and apply backends")
+    parser.add_argument("--files", type=int, default=100, help="Number of files to generate")
+    parser.add_argument("--folder", help="Folder of generated files (default : temporary folder)")
+    parser.add_argument("--benchmarks", nargs="+", default=SCAN_BENCHMARKS + APPLY_BENCHMARKS,
+                        choices=SCAN_BENCHMARKS + APPLY_BENCHMARKS)
+    parser.add_argument("--json", help="Also write results to this file, to compare runs")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    parser.add_argument("measure_folder", nargs="?", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.measure_folder)))
+        return 0
+
+    root = args.folder or tempfile.mkdtemp(prefix="htool_benchmark_")
+    fixtures = os.path.join(root, "fixtures")
+    try:
+        if not os.path.isdir(fixtures):
+            print("Generating " + str(args.files) + " files in " + fixtures + " ...")
+            print(generate_fixtures(fixtures, args.files))
+
+        results = []
+        for name in args.benchmarks:
+            # Every benchmark works on a fresh copy, so that applying does not change the next inputs
+            work = os.path.join(root, name)
+            shutil.rmtree(work, ignore_errors=True)
+            shutil.copytree(fixtures, work)
+            results.append(run(name, work))
+            shutil.rmtree(work, ignore_errors=True)
+        print_results(results)
+
+        if args.json:
+            with open(args.json, "w") as stream:
+                json.dump(results, stream, indent=2)
+    finally:
+        if not args.folder:
+            shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
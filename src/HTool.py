@@ -3,33 +3,58 @@
 
 import sys
 import logging
+import multiprocessing
+import time
 
-from PySide2.QtWidgets import QApplication
-
-from src.pyqt.NifBatchTools.NifBatchTools import NifBatchTools
 from src.utils.config import get_config
 
+
+def init_logging():
+    logging.basicConfig(filemode="w",
+                        filename="htool.log",
+                        level=logging.getLevelName(get_config().get("LOG", "level")),
+                        format='%(asctime)s - [%(levelname)s] - %(name)s : %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+    if not get_config().get("LOG", "enabled"):
+        logger = logging.getLogger()
+        logger.disabled = True
+
+    logging.info(" =============== STARTING LOGGING ===============")
+    logging.info("Log Level : " + get_config().get("LOG", "level"))
+
+
+def run_gui():
+    start = time.perf_counter()
+    # Qt is only imported here, so that the headless mode does not need it
+    from PySide2.QtWidgets import QApplication
+    from src.pyqt.NifBatchTools.NifBatchTools import NifBatchTools
+
+    app = QApplication(sys.argv)
+    tool = NifBatchTools()
+    tool.setAppStyle(app)
+    tool.open()
+    logging.info("Window opened in " + format(time.perf_counter() - start, ".2f") + " s")
+    sys.exit(app.exec_())
+
+
+def run_cli():
+    from src.cli import main
+    sys.exit(main(sys.argv[1:]))
+
+
 if __name__ == '__main__':
+    # Required by worker processes in the frozen executable
+    multiprocessing.freeze_support()
     try:
-        logging.basicConfig(filemode="w",
-                            filename="htool.log",
-                            level=logging.getLevelName(get_config().get("LOG", "level")),
-                            format='%(asctime)s - [%(levelname)s] - %(name)s : %(message)s',
-                            datefmt='%m/%d/%Y %I:%M:%S %p')
-
-        if not get_config().get("LOG", "enabled"):
-            logger = logging.getLogger()
-            logger.disabled = True
-
-        logging.info(" =============== STARTING LOGGING ===============")
-        logging.info("Log Level : " + get_config().get("LOG", "level"))
-        app = QApplication(sys.argv)
-        tool = NifBatchTools()
-        tool.setAppStyle(app)
-        tool.open()
-        sys.exit(app.exec_())
+        init_logging()
+        if "--cli" in sys.argv[1:]:
+            run_cli()
+        else:
+            run_gui()
     except SystemExit:
         logging.info("Closing application")
+        raise
     except:
         logging.exception("Fatal error :")
         raise
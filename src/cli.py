@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Headless batch mode : Qt must never be imported from here
+import argparse
+import json
+import logging
+import signal
+import sys
+import threading
+
+from src.nif.bsa import discard_overrides, extract_overrides
+from src.nif.processing import read_nif_file
+from src.nif.report import ShaderReport
+from src.nif.rules import Rule, RuleSet, load_rules
+from src.nif.scan import SCAN_WORKERS, scan_archives, scan_folder
+from src.utils import status
+from src.utils.backup import BackupStore
+from src.utils.config import get_config
+from src.utils.journal import Journal
+from src.utils.profiling import DEFAULT_PROFILE_FOLDER, BatchStats, merge_profiles
+from src.utils.process_pool import process_files
+from src.utils.scan_cache import ScanCache
+from src.utils.scheduler import JobController, process_files_in_threads
+from src.utils.watcher import watch_folders
+
+log = logging.getLogger(__name__)
+
+STATUS_NAMES = {status.DONE: "processed", status.UNCHANGED: "unchanged", status.FAILED: "failed",
+                status.NONE: "cancelled"}
+
+
+def parse_args(argv):
+    config = get_config()
+    parser = argparse.ArgumentParser(prog="HTool", description="Apply glossiness and specular strength to .nif files")
+    parser.add_argument("--cli", action="store_true", help="Run without GUI")
+    parser.add_argument("folders", nargs="*", default=[config.get("DEFAULT", "SourceFolder")],
+                        help="Folders to scan (default : SourceFolder of htool.ini)")
+    parser.add_argument("--keywords", default=config.get("NIF", "keywords"),
+                        help="Comma separated names of the blocks to modify")
+    parser.add_argument("--glossiness", type=float, default=config.getfloat("NIF", "Glossiness"))
+    parser.add_argument("--specular-strength", type=float, default=config.getfloat("NIF", "SpecularStrength"))
+    parser.add_argument("--rule", action="append", default=[], metavar="[KEYWORD:]FIELD=OPERATION VALUES",
+                        help="Other change to the shader properties, after the ones of htool.ini, e.g. "
+                             "\"alpha=clamp 0 1\" or \"Hands:emissive_multiple=scale 0.5\"")
+    parser.add_argument("--archives", action="store_true",
+                        default=config.getboolean("SCAN", "archives", fallback=False),
+                        help="Also patch meshes stored in the .bsa archives of the folders, written as loose files")
+    parser.add_argument("--preset", default=None,
+                        help="JSON file of rules, instead of the preset of htool.ini")
+    parser.add_argument("--workers", type=int, default=config.getint("APPLY", "workers", fallback=0),
+                        help="Number of processes, 0 to use every core, 1 to process files in this process")
+    parser.add_argument("--write", choices=["atomic", "inplace"],
+                        default=config.get("APPLY", "write", fallback="atomic"),
+                        help="Replace files by patched copies (atomic), or patch them in place (inplace)")
+    parser.add_argument("--backup", action="store_true",
+                        default=config.getboolean("APPLY", "backup", fallback=False),
+                        help="Save files before modifying them")
+    parser.add_argument("--no-journal", dest="journal", action="store_false",
+                        default=config.getboolean("APPLY", "journal", fallback=True),
+                        help="Do not resume an interrupted batch, nor record the progress of this one")
+    parser.add_argument("--profile", action="store_true",
+                        default=config.getboolean("APPLY", "profile", fallback=False),
+                        help="Profile the batch with cProfile, in " + DEFAULT_PROFILE_FOLDER + ".prof")
+    parser.add_argument("--restore", nargs="?", const="", metavar="BACKUP",
+                        help="Put back files saved by a backup (default : the last one), and exit")
+    parser.add_argument("--scan-only", action="store_true", help="Only list relevant files, do not modify them")
+    parser.add_argument("--report", metavar="CSV",
+                        help="Write the current shader values of relevant files in a CSV file and print statistics, "
+                             "without modifying them")
+    parser.add_argument("--json", action="store_true", help="Print a JSON report instead of a summary")
+    parser.add_argument("--watch", action="store_true",
+                        help="Then keep patching files of the folders as soon as they are created or modified, "
+                             "until interrupted (Ctrl+C)")
+    return parser.parse_args(argv)
+
+
+def parse_rule(text):
+    """
+    :param text: [KEYWORD:]FIELD=OPERATION VALUES
+    :return: list of Rule
+    """
+    if "=" not in text:
+        raise ValueError("Invalid rule " + text + ", expected [KEYWORD:]FIELD=OPERATION VALUES")
+    field, operation = text.split("=", 1)
+    keywords = []
+    if ":" in field:
+        keyword, field = field.split(":", 1)
+        keywords.append(keyword.strip().encode("ascii"))
+    return Rule.parse(field.strip(), operation, keywords)
+
+
+def scan(folders, keywords, archives=False):
+    """
+    :param archives: also scan the .nif files stored in the .bsa archives of the folders
+    :return: tuple (relevant files, ignored files, dict path -> NifIndex of relevant files which have one,
+    dict path -> ArchivedFile of relevant files which are only in an archive)
+    """
+    nif_files = set()
+    ignored_nif_files = set()
+    indexes = {}
+    archived = {}
+    cache = ScanCache() if get_config().getboolean("SCAN", "cache", fallback=True) else None
+    workers = get_config().getint("SCAN", "workers", fallback=SCAN_WORKERS)
+    try:
+        for folder in folders:
+            log.info("Scanning directory : " + folder)
+            for path, entry in scan_folder(folder, keywords, nif_files | ignored_nif_files, cache, workers):
+                result = entry.result()
+                if result:
+                    nif_files.add(path)
+                    if entry.nif_index is not None:
+                        indexes[path] = entry.nif_index
+                elif result is not None:
+                    ignored_nif_files.add(path)
+        # Loose files take precedence over archived ones : archives are scanned once every loose file is known
+        for folder in folders if archives else []:
+            for path, entry, archived_file in scan_archives(folder, keywords, nif_files | ignored_nif_files):
+                result = entry.result()
+                if result:
+                    nif_files.add(path)
+                    archived[path] = archived_file
+                elif result is not None:
+                    ignored_nif_files.add(path)
+    finally:
+        if cache is not None:
+            cache.close()
+    return sorted(nif_files), sorted(ignored_nif_files), indexes, archived
+
+
+def apply(nif_files, keywords, rules, workers, indexes, atomic, backup=None, journal=None, stats=None,
+          archived=None):
+    """
+    :param rules: RuleSet to apply
+    :param backup: BackupStore in which files are saved before being processed, or None
+    :param journal: Journal of the batch, to skip files already done by an interrupted run, or None
+    :param stats: profiling.BatchStats to which the timings of each file are added, or None
+    :param archived: dict path -> ArchivedFile of files to extract from archives first, or None
+    :return: list of statuses, in the same order as nif_files
+    """
+    results = [status.FAILED] * len(nif_files)
+    jobs = list(enumerate(nif_files))
+    # Ctrl+C cancels files not started yet, files being processed finish
+    controller = JobController()
+    previous_handler = signal.signal(signal.SIGINT, lambda signum, frame: _cancel(controller))
+    extracted = set()
+    if journal is not None:
+        journal.open()
+    try:
+        if journal is not None:
+            finished, jobs = journal.resume(jobs)
+            for index, result in finished:
+                results[index] = result
+        if archived:
+            extracted = extract_overrides(archived, [path for index, path in jobs])
+        if backup is not None:
+            # Hard links are only valid backups if files are replaced rather than modified. Files extracted from
+            # archives did not exist : there is nothing to save.
+            backup.backup([path for index, path in jobs if path not in extracted], link=atomic)
+        # Threads, or a single worker, process files in this process, without starting any other one
+        backend = get_config().get("APPLY", "backend", fallback="process")
+        process = process_files_in_threads if backend == "thread" or workers == 1 else process_files
+        for index, result in process(jobs, keywords, rules, workers, indexes, atomic, journal, stats, controller):
+            if result is not None:
+                results[index] = result
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        if journal is not None:
+            journal.close()
+        discard_overrides([path for index, path in enumerate(nif_files)
+                           if path in extracted and results[index] != status.DONE])
+    return results
+
+
+def _cancel(controller):
+    print("Cancelling, waiting for files being processed ...", file=sys.stderr)
+    controller.cancel()
+
+
+def report(nif_files, keywords, indexes, path, as_json):
+    shader_report = ShaderReport()
+    for nif_path in nif_files:
+        shader_report.add(nif_path, read_nif_file(nif_path, keywords, indexes.get(nif_path)))
+    try:
+        shader_report.write_csv(path)
+    except OSError as e:
+        print("Unable to write report : " + str(e), file=sys.stderr)
+        return 2
+
+    if as_json:
+        json.dump(shader_report.to_dict(), sys.stdout, indent=2)
+        print()
+    else:
+        print(shader_report.summary())
+    return 1 if shader_report.failed else 0
+
+
+def watch(folders, keywords, rules, atomic, as_json):
+    """
+    Patch files of folders as they are created or modified, until interrupted. One line is printed for each file.
+    """
+    config = get_config()
+    cache = ScanCache() if config.getboolean("SCAN", "cache", fallback=True) else None
+    print("Watching " + ", ".join(folders) + " (Ctrl+C to stop)", file=sys.stderr)
+    try:
+        for path, entry, result in watch_folders(folders, keywords, rules, threading.Event(), atomic, cache,
+                                                 config.getfloat("WATCH", "debounce", fallback=2.0),
+                                                 config.getfloat("WATCH", "interval", fallback=1.0)):
+            name = "ignored" if result is None else STATUS_NAMES[result]
+            if as_json:
+                print(json.dumps({"path": path, "status": name}), flush=True)
+            else:
+                print(name.capitalize() + " : " + path, flush=True)
+            if cache is not None:
+                # Results are kept if interrupted
+                cache.commit()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if cache is not None:
+            cache.close()
+    return 0
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.restore is not None:
+        try:
+            restored, errors = BackupStore().restore(args.restore or None)
+        except (OSError, ValueError) as e:
+            print("Unable to restore backup : " + str(e), file=sys.stderr)
+            return 2
+        print(str(restored) + " restored, " + str(errors) + " failed")
+        return 1 if errors else 0
+
+    keywords = [keyword.encode("ascii") for keyword in args.keywords.replace(" ", "").split(",") if keyword]
+    try:
+        rules = load_rules(get_config(), args.preset)
+        for rule in args.rule:
+            rules += parse_rule(rule)
+    except (OSError, ValueError) as e:
+        print("Invalid rules : " + str(e), file=sys.stderr)
+        return 2
+    rules = RuleSet.from_values(args.glossiness, args.specular_strength, rules)
+    folders = [folder for folder in args.folders if folder]
+    if not folders:
+        print("No folder to scan", file=sys.stderr)
+        return 2
+
+    nif_files, ignored_nif_files, indexes, archived = scan(folders, keywords, args.archives)
+    if args.report:
+        # Reports never write anything : archived files, which would have to be extracted, are left out
+        return report([path for path in nif_files if path not in archived], keywords, indexes, args.report,
+                      args.json)
+
+    files = [{"path": path, "status": "loaded"} for path in nif_files]
+    for file in files:
+        if file["path"] in archived:
+            file["archive"] = archived[file["path"]].archive_path
+    files += [{"path": path, "status": "ignored"} for path in ignored_nif_files]
+
+    stats = None
+    if not args.scan_only and nif_files:
+        log.info("Applying parameters to " + str(len(nif_files)) + " files ...")
+        backup = BackupStore() if args.backup else None
+        journal = Journal(keywords, rules) if args.journal else None
+        stats = BatchStats(DEFAULT_PROFILE_FOLDER if args.profile else None)
+        results = apply(nif_files, keywords, rules, args.workers, indexes, args.write == "atomic", backup, journal,
+                        stats, archived)
+        for file, result in zip(files, results):
+            file["status"] = STATUS_NAMES[result]
+        log.info(stats.summary())
+        if stats.profile_folder is not None:
+            log.info("Profile of the batch : " + merge_profiles(stats.profile_folder, stats.profile_folder + ".prof"))
+
+    summary = {}
+    for file in files:
+        summary[file["status"]] = summary.get(file["status"], 0) + 1
+
+    if args.json:
+        output = {"summary": summary, "files": files}
+        if stats is not None:
+            output["stats"] = stats.to_dict()
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    else:
+        for file in files:
+            if file["status"] == "failed":
+                print("Failed : " + file["path"])
+        print(", ".join(str(count) + " " + name for name, count in sorted(summary.items())) or "No .nif file found")
+        if stats is not None:
+            print(stats.summary())
+
+    if summary.get("cancelled"):
+        return 1
+    if args.watch:
+        return watch(folders, keywords, rules, args.write == "atomic", args.json)
+    return 1 if summary.get("failed") else 0
@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import mmap
+import os
+import shutil
+import zlib
+
+from src.nif.header import BufferReader, TruncatedNifError
+from src.utils.files import AtomicFile
+
+try:
+    import lz4.frame
+except ImportError:  # Optional : only needed by compressed archives of Skyrim SE
+    lz4 = None
+
+log = logging.getLogger(__name__)
+
+# Oblivion, Fallout 3 / New Vegas / Skyrim LE, Skyrim SE
+SUPPORTED_VERSIONS = (103, 104, 105)
+
+ARCHIVE_DIRECTORY_NAMES = 0x1
+ARCHIVE_FILE_NAMES = 0x2
+ARCHIVE_COMPRESSED = 0x4
+ARCHIVE_EMBEDDED_NAMES = 0x100  # From version 104
+FILE_COMPRESSION_TOGGLE = 0x40000000
+FILE_SIZE_MASK = 0x3FFFFFFF
+READ_CHUNK = 64 * 1024  # compressed bytes decompressed at once, when only the beginning of a file is read
+
+
+class BsaError(Exception):
+    """ Raised when an archive can't be read : not a .bsa file, unsupported version, compression, ... """
+
+
+class BsaEntry:
+    """ File stored in an archive """
+
+    def __init__(self, path, offset, size, compressed):
+        self.path = path  # as stored, e.g. meshes\actors\character\character assets\femalebody_0.nif
+        self.offset = offset
+        self.size = size
+        self.compressed = compressed
+
+
+class BsaArchive:
+    """
+    Read only access to the files of a .bsa archive. Only the folder and file records are parsed when opening, the
+    content of a file is only read (and decompressed) when asked.
+
+    with BsaArchive(path) as archive:
+        for entry in archive.entries:
+            content = archive.read(entry)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.stream = None
+        self.buffer = None
+
+    def open(self):
+        self.stream = open(self.path, "rb")
+        try:
+            self.buffer = mmap.mmap(self.stream.fileno(), 0, access=mmap.ACCESS_READ)
+            self.entries = self._read_records()
+        except (ValueError, TruncatedNifError) as e:
+            self.close()
+            raise BsaError("Invalid archive " + self.path + " : " + str(e))
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _read_records(self):
+        reader = BufferReader(self.buffer)
+        magic, self.version, offset, flags, folder_count, file_count, folder_names_length, file_names_length, \
+            file_flags = reader.unpack("<4sIIIIIIII")
+        if magic != b"BSA\0":
+            raise BsaError("Not a .bsa file : " + self.path)
+        if self.version not in SUPPORTED_VERSIONS:
+            raise BsaError("Unsupported archive version " + str(self.version) + " : " + self.path)
+        if not flags & ARCHIVE_DIRECTORY_NAMES or not flags & ARCHIVE_FILE_NAMES:
+            raise BsaError("Archive without names : " + self.path)
+        self.embedded_names = self.version >= 104 and bool(flags & ARCHIVE_EMBEDDED_NAMES)
+
+        reader.offset = offset
+        folder_record = "<QIIQ" if self.version == 105 else "<QII"
+        counts = [reader.unpack(folder_record)[1] for index in range(folder_count)]
+
+        files = []
+        for count in counts:
+            folder = reader.short_string().rstrip(b"\0")
+            for index in range(count):
+                name_hash, size, file_offset = reader.unpack("<QII")
+                compressed = bool(flags & ARCHIVE_COMPRESSED) != bool(size & FILE_COMPRESSION_TOGGLE)
+                files.append((folder, file_offset, size & FILE_SIZE_MASK, compressed))
+
+        entries = []
+        for folder, file_offset, size, compressed in files:
+            end = self.buffer.find(b"\0", reader.offset)
+            if end < 0:
+                raise TruncatedNifError("Unexpected end of file names")
+            name = bytes(self.buffer[reader.offset:end])
+            reader.offset = end + 1
+            path = (folder + b"\\" + name if folder else name).decode("ascii", "replace")
+            entries.append(BsaEntry(path, file_offset, size, compressed))
+        if len(entries) != file_count:
+            raise BsaError("Expected " + str(file_count) + " files, found " + str(len(entries)))
+        if self.version == 105 and lz4 is None and any(entry.compressed for entry in entries):
+            raise BsaError("lz4 is required to read compressed archives of Skyrim SE : " + self.path)
+        return entries
+
+    def read(self, entry, size=None):
+        """
+        :param size: number of bytes to read from the beginning of entry, None to read all of it. Compressed data is
+        only decompressed up to there.
+        :return: bytes, uncompressed content of entry, or its first size bytes
+        """
+        reader = BufferReader(self.buffer, entry.offset)
+        end = entry.offset + entry.size
+        if self.embedded_names:
+            reader.short_string()
+        if not entry.compressed:
+            return reader.raw(end - reader.offset if size is None else min(size, end - reader.offset))
+
+        original_size = reader.uint()
+        if self.version == 105 and lz4 is None:
+            raise BsaError("lz4 is required to read compressed archives of Skyrim SE : " + self.path)
+        if size is None or size >= original_size:
+            data = self.buffer[reader.offset:end]
+            try:
+                content = lz4.frame.decompress(data) if self.version == 105 else zlib.decompress(data)
+            except (RuntimeError, zlib.error) as e:
+                raise BsaError("Invalid compressed file " + entry.path + " : " + str(e))
+            if len(content) != original_size:
+                raise BsaError("Unexpected size for " + entry.path)
+            return content if size is None else content[:size]
+        return self._read_start(entry, reader.offset, end, size)
+
+    def _read_start(self, entry, start, end, size):
+        """
+        :return: first size bytes of the compressed data of entry, between start and end, decompressed by chunks
+        """
+        if self.version == 105:
+            decompressor = lz4.frame.LZ4FrameDecompressor()
+        else:
+            decompressor = zlib.decompressobj()
+        content = b""
+        try:
+            for offset in range(start, end, READ_CHUNK):
+                content += decompressor.decompress(self.buffer[offset:min(offset + READ_CHUNK, end)],
+                                                   size - len(content))
+                if len(content) >= size:
+                    break
+        except (RuntimeError, zlib.error) as e:
+            raise BsaError("Invalid compressed file " + entry.path + " : " + str(e))
+        return content
+
+
+class ArchivedFile:
+    """ Relevant .nif file found in an archive, to be written as a loose file overriding it """
+
+    def __init__(self, archive_path, entry_path):
+        self.archive_path = archive_path
+        self.entry_path = entry_path
+
+
+def override_path(archive_path, entry):
+    """
+    :return: path of the loose file overriding entry : loose files in the folder of the archive (the Data folder) take
+    precedence over archived ones. Written the same way as by scan.find_nif_files.
+    """
+    directory, name = os.path.split(entry.path.replace("\\", os.sep))
+    return os.path.join(os.path.dirname(archive_path), directory) + "/" + name
+
+
+def find_archives(folder):
+    """
+    :return: sorted list of the paths of the .bsa files of folder and its sub folders
+    """
+    archives = []
+    for directory, directories, files in os.walk(folder):
+        archives += [os.path.join(directory, name) for name in files if name.lower().endswith(".bsa")]
+    return sorted(archives)
+
+
+def extract_overrides(archived, paths):
+    """
+    Write archived files as loose files, so that they can be processed as any other file
+    :param archived: dict path of a loose file -> ArchivedFile
+    :param paths: paths to extract, if in archived and not already there
+    :return: set of the paths extracted
+    """
+    by_archive = {}
+    for path in paths:
+        if path in archived and not os.path.exists(path):
+            by_archive.setdefault(archived[path].archive_path, []).append(path)
+
+    extracted = set()
+    for archive_path, archive_paths in by_archive.items():
+        try:
+            with BsaArchive(archive_path) as archive:
+                entries = {entry.path: entry for entry in archive.entries}
+                for path in archive_paths:
+                    try:
+                        content = archive.read(entries[archived[path].entry_path])
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        with AtomicFile(path) as file:
+                            with open(file.temp_path, "wb") as stream:
+                                stream.write(content)
+                            # Same permissions as any other file of the Data folder, rather than the temporary file's
+                            shutil.copymode(archive_path, file.temp_path)
+                            file.commit()
+                    except (OSError, BsaError, KeyError):
+                        log.exception("[" + path + "] - Error while extracting from " + archive_path)
+                        continue
+                    extracted.add(path)
+        except (OSError, BsaError):
+            log.exception("[" + archive_path + "] - Error")
+    if extracted:
+        log.info(str(len(extracted)) + " files extracted from archives")
+    return extracted
+
+
+def discard_overrides(paths):
+    """
+    Remove loose files extracted from archives which have not been patched (unchanged, failed or cancelled) : they
+    would only override the archived files with the same content.
+    """
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            log.exception("[" + path + "] - Error while removing")
+    if paths:
+        log.info(str(len(paths)) + " files extracted from archives removed, as not patched")
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import struct
+
+VERSION_10_0_1_0 = 0x0A000100
+VERSION_10_0_1_2 = 0x0A000102
+VERSION_10_1_0_0 = 0x0A010000
+VERSION_10_2_0_0 = 0x0A020000
+VERSION_20_0_0_4 = 0x14000004
+VERSION_20_1_0_3 = 0x14010003
+VERSION_20_2_0_7 = 0x14020007
+
+HEADER_READ_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024 * 1024
+
+
+class NifFormatError(Exception):
+    """ Raised when the file is not a valid .nif file """
+
+
+class TruncatedNifError(NifFormatError):
+    """ Raised when the end of the data is reached before the end of the parsed structure """
+
+
+class UnsupportedNifError(Exception):
+    """ Raised when the file is valid, but uses a version or a layout not handled without pyffi """
+
+
+class BufferReader:
+    """ Sequential little endian reader over a bytes-like object (bytes, mmap, memoryview) """
+
+    def __init__(self, buffer, offset=0):
+        self.buffer = buffer
+        self.offset = offset
+
+    def unpack(self, fmt):
+        try:
+            values = struct.unpack_from(fmt, self.buffer, self.offset)
+        except struct.error:
+            raise TruncatedNifError("Unexpected end of data at offset " + str(self.offset))
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def uint(self):
+        return self.unpack("<I")[0]
+
+    def sint(self):
+        return self.unpack("<i")[0]
+
+    def ushort(self):
+        return self.unpack("<H")[0]
+
+    def byte(self):
+        return self.unpack("<B")[0]
+
+    def raw(self, length):
+        if self.offset + length > len(self.buffer):
+            raise TruncatedNifError("Unexpected end of data at offset " + str(self.offset))
+        value = bytes(self.buffer[self.offset:self.offset + length])
+        self.offset += length
+        return value
+
+    def short_string(self):
+        return self.raw(self.byte())
+
+    def sized_string(self):
+        return self.raw(self.uint())
+
+
+class NifHeader:
+    """
+    Minimal representation of a .nif header : versions, block types, block sizes and string table.
+    Block sizes are only available from version 20.2.0.7, strings from version 20.1.0.3.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.user_version = 0
+        self.user_version_2 = 0
+        self.num_blocks = 0
+        self.block_types = []
+        self.block_type_index = []
+        self.block_sizes = []
+        self.strings = []
+        self.size = 0  # Offset of the first block
+
+    def block_type(self, index):
+        return self.block_types[self.block_type_index[index]]
+
+    def block_offsets(self):
+        """
+        :return: list of the absolute offset of each block
+        """
+        offsets = []
+        offset = self.size
+        for size in self.block_sizes:
+            offsets.append(offset)
+            offset += size
+        return offsets
+
+    def footer_offset(self):
+        return self.size + sum(self.block_sizes)
+
+    def string(self, index):
+        """
+        :param index: index in the string table, as stored in a block
+        :return: string, or None if index does not refer to a string
+        """
+        if 0 <= index < len(self.strings):
+            return self.strings[index]
+        return None
+
+
+def read_header(buffer):
+    """
+    Parse header of a .nif file, following the same rules as pyffi
+    :param buffer: bytes-like object, starting at the beginning of the file
+    :return: NifHeader
+    """
+    header = NifHeader()
+    reader = BufferReader(buffer)
+
+    end = bytes(buffer[:128]).find(b"\n")
+    if end == -1 or not (buffer[:22] == b"Gamebryo File Format, " or buffer[:24] == b"NetImmerse File Format, "):
+        raise NifFormatError("Not a .nif file")
+    reader.offset = end + 1
+
+    header.version = reader.uint()
+    # Older versions do not list block types in the header
+    if header.version < VERSION_10_0_1_0 or header.version > VERSION_20_2_0_7:
+        raise UnsupportedNifError("Unsupported version " + hex(header.version))
+
+    if header.version >= VERSION_20_0_0_4 and reader.byte() != 1:
+        raise UnsupportedNifError("Big endian files are not supported")
+
+    if header.version >= VERSION_10_1_0_0:
+        header.user_version = reader.uint()
+    header.num_blocks = reader.uint()
+    if header.version == VERSION_10_0_1_2:
+        reader.uint()
+        _read_export_info(reader)
+    elif header.version >= VERSION_10_1_0_0 and (header.user_version >= 10 or (
+            header.user_version == 1 and header.version != VERSION_10_2_0_0)):
+        header.user_version_2 = reader.uint()
+        if header.user_version_2 >= 130:
+            raise UnsupportedNifError("Unsupported user version 2 " + str(header.user_version_2))
+        _read_export_info(reader)
+
+    num_block_types = reader.ushort()
+    header.block_types = [reader.sized_string() for _ in range(num_block_types)]
+    # Upper bit is a flag used for PhysX block types
+    header.block_type_index = [index & 0x7FFF for index in reader.unpack("<" + str(header.num_blocks) + "H")]
+    if header.version >= VERSION_20_2_0_7:
+        header.block_sizes = list(reader.unpack("<" + str(header.num_blocks) + "I"))
+
+    if header.version >= VERSION_20_1_0_3:
+        num_strings = reader.uint()
+        reader.uint()  # Max string length
+        header.strings = [reader.sized_string() for _ in range(num_strings)]
+
+    if reader.uint() != 0:
+        raise UnsupportedNifError("Groups are not supported")
+
+    for index in header.block_type_index:
+        if index >= num_block_types:
+            raise NifFormatError("Invalid block type index " + str(index))
+
+    header.size = reader.offset
+    return header
+
+
+def _read_export_info(reader):
+    reader.short_string()  # Creator
+    reader.short_string()
+    reader.short_string()
+
+
+def read_file_header(path, read_size=HEADER_READ_SIZE, max_size=MAX_HEADER_SIZE):
+    """
+    Parse header of a .nif file, reading only the beginning of the file
+    :param read_size: number of bytes read first, more are read if the header is bigger
+    :param max_size: maximum number of bytes read
+    :return: NifHeader
+    """
+    with open(path, "rb") as stream:
+        def read(size):
+            stream.seek(0)
+            return stream.read(size)
+        return read_partial_header(read, read_size, max_size)
+
+
+def read_partial_header(read, read_size=HEADER_READ_SIZE, max_size=MAX_HEADER_SIZE):
+    """
+    Parse header of a .nif file, from the beginning of its content only
+    :param read: function(size) returning the first size bytes of the file, fewer if the file is smaller
+    :param read_size: number of bytes read first, more are read if the header is bigger
+    :param max_size: maximum number of bytes read
+    :return: NifHeader
+    """
+    buffer = read(read_size)
+    while True:
+        try:
+            return read_header(buffer)
+        except TruncatedNifError:
+            # Either the end of the file, or the limit, has been reached
+            if len(buffer) < read_size or read_size >= max_size:
+                raise
+            read_size = min(read_size * 4, max_size)
+            buffer = read(read_size)
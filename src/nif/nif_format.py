@@ -0,0 +1,28 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# pyffi parses nif.xml and builds a class for each block type when imported, which takes a while : it is only
+# imported by the first file which needs it, in the thread or process handling that file
+_lock = threading.Lock()
+_nif_format = None
+
+
+def get_nif_format():
+    """
+    :return: pyffi's NifFormat, imported on the first call
+    """
+    global _nif_format
+    if _nif_format is None:
+        with _lock:
+            if _nif_format is None:
+                start = time.perf_counter()
+                from pyffi.formats.nif import NifFormat
+                log.info("Loaded pyffi NIF format in " + format(time.perf_counter() - start, ".2f") + " s")
+                _nif_format = NifFormat
+    return _nif_format
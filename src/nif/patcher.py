@@ -0,0 +1,405 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import io
+import logging
+import mmap
+import os
+import struct
+
+from src.nif.header import BufferReader, NifFormatError, UnsupportedNifError, VERSION_20_2_0_7, read_header
+from src.nif.nif_format import get_nif_format
+from src.nif.rules import FIELDS, format_values, transform
+from src.utils import profiling, status
+from src.utils.files import AtomicFile
+
+log = logging.getLogger(__name__)
+
+# Bethesda stream versions (User Version 2) whose block layouts are known : Skyrim LE and Skyrim SE
+SUPPORTED_USER_VERSION = 12
+SUPPORTED_USER_VERSION_2 = (83, 100)
+
+NODE_TYPES = {b"NiNode", b"BSFadeNode", b"BSLeafAnimNode", b"RootCollisionNode"}
+GEOMETRY_TYPES = {b"NiTriShape", b"NiTriStrips"}
+SHADER_TYPE = b"BSLightingShaderProperty"
+# Blocks whose only references are the ones of NiObjectNET (extra data, controller)
+OBJECT_NET_TYPES = {b"NiAlphaProperty"}
+# Named blocks without any reference
+EXTRA_DATA_TYPES = {b"NiStringExtraData", b"NiIntegerExtraData", b"BSXFlags", b"NiBinaryExtraData",
+                    b"NiFloatExtraData", b"NiStringsExtraData", b"NiIntegersExtraData", b"NiFloatsExtraData",
+                    b"BSBehaviorGraphExtraData", b"BSInvMarker", b"BSBound", b"BSFurnitureMarker",
+                    b"BSFurnitureMarkerNode", b"BSDecalPlacementVectorExtraData"}
+# Blocks without name, and which can only lead to blocks without name
+LEAF_TYPES = {b"NiTriShapeData", b"NiTriStripsData", b"NiSkinInstance", b"BSDismemberSkinInstance", b"NiSkinData",
+              b"NiSkinPartition", b"BSShaderTextureSet"}
+LEAF_TYPE_PREFIXES = (b"bhk",)  # Havok collision
+
+# Flags, Unknown Short 1, Translation, Rotation, Scale
+AV_OBJECT_TRANSFORM_SIZE = 2 + 2 + 12 + 36 + 4
+
+# BSLightingShaderProperty fields, relative to the end of NiObjectNET fields (numeric ones are in rules.FIELDS)
+SHADER_TEXTURE_SET_OFFSET = 24
+SHADER_SIZE = 84
+# Size of optional fields, depending on Skyrim Shader Type
+SHADER_TYPE_SIZES = {1: 4, 5: 12, 6: 12, 7: 8, 11: 20, 14: 16, 16: 28}
+
+
+class ShaderProperty:
+    """ Location of the patched fields of a BSLightingShaderProperty """
+
+    def __init__(self, index, offset):
+        self.index = index
+        self.offset = offset  # End of NiObjectNET fields, see rules.ShaderField
+
+
+class NifIndex:
+    """
+    Location of the blocks to patch in a file, found when scanning it, so that applying does not search them again.
+    Only valid as long as the file keeps the same size and modification time.
+    """
+
+    def __init__(self, size, mtime_ns, block, keyword, shaders):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.block = block  # Block matching a keyword, -1 if none
+        self.keyword = keyword  # Position of this keyword in the list of keywords, -1 if none
+        self.shaders = shaders  # list of ShaderProperty below this block
+
+    def is_valid(self, stat):
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def to_bytes(self):
+        values = [self.block, self.keyword]
+        for shader in self.shaders:
+            values += [shader.index, shader.offset]
+        return struct.pack("<" + str(len(values)) + "i", *values)
+
+    @staticmethod
+    def from_bytes(data, size, mtime_ns):
+        values = struct.unpack("<" + str(len(data) // 4) + "i", data)
+        return NifIndex(size, mtime_ns, values[0], values[1],
+                        [ShaderProperty(index, offset) for index, offset in zip(values[2::2], values[3::2])])
+
+
+class SceneGraph:
+    """
+    Lazy view of the blocks of a .nif file. Only blocks reached while walking from the root are decoded, and only
+    the fields needed to walk the graph are read : geometry is never touched.
+    Blocks of other types found on the way (controllers, unusual nodes, ...) are decoded by pyffi, from their own
+    bytes only, thanks to the block sizes.
+    """
+
+    def __init__(self, buffer, header):
+        self.buffer = buffer
+        self.header = header
+        self.offsets = header.block_offsets()
+        self.blocks = {}
+        self.pyffi_data = None
+
+    def roots(self):
+        reader = BufferReader(self.buffer, self.header.footer_offset())
+        return [root for root in reader.unpack("<" + str(reader.uint()) + "i") if root >= 0]
+
+    def block(self, index):
+        """
+        :return: tuple (name, referenced blocks, ShaderProperty or None)
+        """
+        if index not in self.blocks:
+            if index >= self.header.num_blocks:
+                raise NifFormatError("Invalid reference to block " + str(index))
+            self.blocks[index] = self._read_block(index)
+        return self.blocks[index]
+
+    def _read_block(self, index):
+        block_type = self.header.block_type(index)
+        end = self.offsets[index] + self.header.block_sizes[index]
+        profiling.count(read=self.header.block_sizes[index])
+        reader = BufferReader(self.buffer, self.offsets[index])
+        shader = None
+
+        if block_type in NODE_TYPES:
+            name, refs = self._read_object_net(reader)
+            reader.offset += AV_OBJECT_TRANSFORM_SIZE
+            refs.append(reader.sint())  # Collision Object
+            refs += reader.unpack("<" + str(reader.uint()) + "i")  # Children
+            refs += reader.unpack("<" + str(reader.uint()) + "i")  # Effects
+        elif block_type in GEOMETRY_TYPES:
+            name, refs = self._read_object_net(reader)
+            reader.offset += AV_OBJECT_TRANSFORM_SIZE
+            refs.append(reader.sint())  # Collision Object
+            refs += reader.unpack("<2i")  # Data, Skin Instance
+            num_materials = reader.uint()
+            # Material Name, Material Extra Data, Active Material, Dirty Flag
+            reader.offset += 8 * num_materials + 4 + 1
+            refs += reader.unpack("<2i")  # BS Properties
+        elif block_type == SHADER_TYPE:
+            shader_type = reader.uint()
+            name, refs = self._read_object_net(reader)
+            shader = ShaderProperty(index, reader.offset)
+            refs.append(struct.unpack_from("<i", self.buffer, reader.offset + SHADER_TEXTURE_SET_OFFSET)[0])
+            reader.offset += SHADER_SIZE + SHADER_TYPE_SIZES.get(shader_type, 0)
+        elif block_type in OBJECT_NET_TYPES:
+            name, refs = self._read_object_net(reader)
+            reader.offset = end
+        elif block_type in EXTRA_DATA_TYPES:
+            name, refs = self.header.string(reader.sint()), []
+            reader.offset = end
+        elif block_type in LEAF_TYPES or block_type.startswith(LEAF_TYPE_PREFIXES):
+            return None, [], None
+        else:
+            return self._read_block_pyffi(index, block_type)
+
+        if reader.offset != end:
+            raise UnsupportedNifError("Unexpected size for block " + str(index) + " (" +
+                                      block_type.decode("ascii", "replace") + ")")
+        return name, [ref for ref in refs if ref >= 0], shader
+
+    def _read_block_pyffi(self, index, block_type):
+        """
+        Decode a single block with pyffi, without reading the rest of the file
+        :return: tuple (name, referenced blocks, None)
+        """
+        nif_format = get_nif_format()
+        if self.pyffi_data is None:
+            self.pyffi_data = nif_format.Data(self.header.version, self.header.user_version,
+                                              self.header.user_version_2)
+            self.pyffi_data._string_list = self.header.strings
+        data = self.pyffi_data
+        block = _new_pyffi_block(nif_format, block_type)
+
+        size = self.header.block_sizes[index]
+        stream = io.BytesIO(self.buffer[self.offsets[index]:self.offsets[index] + size])
+        data._link_stack = []
+        try:
+            block.read(stream, data)
+        except Exception as e:
+            raise UnsupportedNifError("Unable to read block " + str(index) + " (" +
+                                      block_type.decode("ascii", "replace") + ") : " + repr(e))
+        if stream.tell() != size:
+            raise UnsupportedNifError("Unexpected size for block " + str(index) + " (" +
+                                      block_type.decode("ascii", "replace") + ")")
+
+        # Links are resolved to empty blocks of the right type, standing for the blocks of the file, so that pyffi
+        # tells references (children) from pointers (parents)
+        placeholders = {}
+        for link in data._link_stack:
+            if 0 <= link < self.header.num_blocks and link not in placeholders:
+                placeholders[link] = _new_pyffi_block(nif_format, self.header.block_type(link))
+            elif link >= self.header.num_blocks or link < -1:
+                raise NifFormatError("Invalid reference to block " + str(link))
+        data._block_dct = placeholders
+        block.fix_links(data)
+        links = {id(placeholder): link for link, placeholder in placeholders.items()}
+        refs = [links[id(ref)] for ref in block.get_refs(data)]
+
+        name = getattr(block, "name", None)
+        return name if isinstance(name, bytes) else None, refs, None
+
+    def _read_object_net(self, reader):
+        name = self.header.string(reader.sint())
+        refs = list(reader.unpack("<" + str(reader.uint()) + "i"))  # Extra Data List
+        refs.append(reader.sint())  # Controller
+        return name, refs
+
+    def find(self, index, name):
+        """
+        Depth-first search of a block by name, in the same order as pyffi's NiObjectNET.find
+        :return: index of the block, or None
+        """
+        stack = [index]
+        visited = set()
+        while stack:
+            index = stack.pop()
+            if index in visited:
+                continue
+            visited.add(index)
+            block_name, refs, _ = self.block(index)
+            if block_name == name:
+                return index
+            stack.extend(reversed(refs))
+        return None
+
+    def shader_properties(self, index):
+        """
+        :return: list of ShaderProperty found in the tree below block
+        """
+        shaders = []
+        stack = [index]
+        visited = set()
+        while stack:
+            index = stack.pop()
+            if index in visited:
+                continue
+            visited.add(index)
+            _, refs, shader = self.block(index)
+            if shader is not None:
+                shaders.append(shader)
+            stack.extend(reversed(refs))
+        return shaders
+
+
+def _new_pyffi_block(nif_format, block_type):
+    try:
+        return getattr(nif_format, block_type.decode("ascii"))()
+    except (AttributeError, UnicodeDecodeError):
+        raise UnsupportedNifError("Unsupported block type " + block_type.decode("ascii", "replace"))
+
+
+def find_shader_properties(buffer, header, keywords):
+    """
+    Find BSLightingShaderProperty blocks below the first block whose name matches a keyword.
+    Keywords are tried in order, as in process_nif_file_pyffi.
+    :param buffer: content of the file
+    :param header: NifHeader of the file
+    :param keywords: list of block names (bytes)
+    :return: tuple (index of the block matching a keyword or -1, position of this keyword or -1,
+    list of ShaderProperty)
+    """
+    if header.version != VERSION_20_2_0_7:
+        raise UnsupportedNifError("Unsupported version " + hex(header.version))
+    if header.user_version != SUPPORTED_USER_VERSION or header.user_version_2 not in SUPPORTED_USER_VERSION_2:
+        raise UnsupportedNifError("Unsupported user version " + str(header.user_version) + "." +
+                                  str(header.user_version_2))
+
+    graph = SceneGraph(buffer, header)
+    roots = graph.roots()
+    if not roots:
+        return -1, -1, []
+
+    for position, keyword in enumerate(keywords):
+        block = graph.find(roots[0], keyword)
+        if block is not None:
+            return block, position, graph.shader_properties(block)
+    return -1, -1, []
+
+
+def index_nif_file(path, keywords, header=None):
+    """
+    Find the blocks to patch, without modifying the file
+    :param header: NifHeader of the file, if already read
+    :return: NifIndex
+    """
+    with open(path, "rb") as stream:
+        stat = os.fstat(stream.fileno())
+        try:
+            buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise NifFormatError("Empty file")
+
+        try:
+            block, keyword, shaders = find_shader_properties(buffer, header or read_header(buffer), keywords)
+        finally:
+            buffer.close()
+    return NifIndex(stat.st_size, stat.st_mtime_ns, block, keyword, shaders)
+
+
+def _locate_shader_properties(buffer, stat, keywords, nif_index):
+    """
+    :return: tuple (position of the keyword matching a block or -1, list of ShaderProperty)
+    """
+    if nif_index is not None and nif_index.is_valid(stat):
+        return nif_index.keyword, nif_index.shaders
+    with profiling.stage("parse"):
+        header = read_header(buffer)
+        profiling.count(read=header.size)
+    with profiling.stage("find"):
+        return find_shader_properties(buffer, header, keywords)[1:]
+
+
+def read_shader_values(path, keywords, nif_index=None):
+    """
+    Read the numeric fields of relevant BSLightingShaderProperty blocks, the same way patch_nif_file finds them
+    :return: tuple (keyword matching a block or None, list of (block index, dict field name -> tuple of values))
+    """
+    with open(path, "rb") as stream:
+        try:
+            buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise NifFormatError("Empty file")
+
+        try:
+            keyword, shaders = _locate_shader_properties(buffer, os.fstat(stream.fileno()), keywords, nif_index)
+            values = [(shader.index, {name: struct.unpack_from(field.format, buffer, shader.offset + field.offset)
+                                      for name, field in FIELDS.items()})
+                      for shader in shaders]
+        finally:
+            buffer.close()
+    return keywords[keyword] if keyword >= 0 else None, values
+
+
+def patch_nif_file(path, keywords, rules, nif_index=None, atomic=True):
+    """
+    Apply rules to relevant BSLightingShaderProperty blocks, by overwriting their values.
+    Only the header and the blocks on the way to the shader properties are read, or nothing at all if the file
+    has not changed since nif_index was built.
+    Nothing is written if every value is already the requested one.
+    Raise UnsupportedNifError or NifFormatError, before anything is written, if the file cannot be handled this way.
+    :param rules: RuleSet to apply
+    :param nif_index: NifIndex built when scanning the file, or None
+    :param atomic: write a patched copy which then replaces the file, rather than patching the file in place
+    :return: status.DONE if at least one block has been modified, status.UNCHANGED if values were already set,
+    status.FAILED if no block has been found
+    """
+    with profiling.stage("open"):
+        stream = open(path, "rb" if atomic else "r+b")
+    with stream:
+        try:
+            with profiling.stage("open"):
+                buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ if atomic else mmap.ACCESS_WRITE)
+        except ValueError:
+            raise NifFormatError("Empty file")
+
+        try:
+            keyword, shaders = _locate_shader_properties(buffer, os.fstat(stream.fileno()), keywords, nif_index)
+            fields = rules.for_keyword(keywords[keyword]) if shaders else []
+
+            # (offset, packed values) to write
+            modified = []
+            with profiling.stage("modify"):
+                for shader in shaders:
+                    values = []
+                    changed = False
+                    for name, field_rules in fields:
+                        field = FIELDS[name]
+                        offset = shader.offset + field.offset
+                        old_values = struct.unpack_from(field.format, buffer, offset)
+                        new_values, packed = transform(field_rules, old_values)
+                        if buffer[offset:offset + field.size] == packed:
+                            values.append(field.label + " " + format_values(old_values))
+                            continue
+                        modified.append((offset, packed))
+                        values.append(field.label + " " + format_values(old_values) + " -> " +
+                                      format_values(new_values))
+                        changed = True
+                    if changed:
+                        log.info("[" + path + "] ------ " + " | ".join(values))
+                    else:
+                        log.info("[" + path + "] ------ Unchanged : " + " | ".join(values))
+
+            if modified:
+                # The whole file is only copied when there is something to write
+                with profiling.stage("serialize"):
+                    content = bytearray(buffer) if atomic else buffer
+                    if atomic:
+                        profiling.count(read=len(content))
+                    for offset, packed in modified:
+                        content[offset:offset + len(packed)] = packed
+                if not atomic:
+                    with profiling.stage("write"):
+                        buffer.flush()
+                    profiling.count(written=sum(len(packed) for offset, packed in modified))
+        finally:
+            buffer.close()
+
+    if not modified:
+        return status.UNCHANGED if shaders else status.FAILED
+
+    if atomic:
+        # Replaced once the original file is closed : a file still open can't be replaced on Windows
+        with profiling.stage("write"):
+            with AtomicFile(path) as file:
+                with open(file.temp_path, "wb") as stream:
+                    stream.write(content)
+                file.commit()
+        profiling.count(written=len(content))
+    return status.DONE
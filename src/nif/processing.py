@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import io
+import logging
+
+from src.nif.header import NifFormatError, UnsupportedNifError
+from src.nif.nif_format import get_nif_format
+from src.nif.patcher import patch_nif_file, read_shader_values
+from src.nif.rules import FIELDS, format_values, transform
+from src.utils import profiling, status
+from src.utils.files import AtomicFile
+
+log = logging.getLogger(__name__)
+
+
+def process_nif_file(path, keywords, rules, nif_index=None, atomic=True):
+    """
+    Apply rules to the BSLightingShaderProperty blocks below the first block whose name matches one of the keywords.
+    :param rules: RuleSet to apply
+    :param nif_index: NifIndex built when scanning the file, or None
+    :param atomic: write a new file which then replaces the original one, so that a crash never leaves a half
+                   written file. Otherwise, the file is modified in place.
+    :return: status.DONE if the file has been modified, status.UNCHANGED if it already had these values,
+    status.FAILED otherwise
+    """
+    # Fast path : values are overwritten in place, without parsing the whole file
+    try:
+        return patch_nif_file(path, keywords, rules, nif_index, atomic)
+    except (UnsupportedNifError, NifFormatError) as e:
+        log.debug("[" + path + "] - Falling back to pyffi : " + str(e))
+    except OSError:
+        log.exception("Error while patching file : " + path)
+        return status.FAILED
+
+    return process_nif_file_pyffi(path, keywords, rules, atomic)
+
+
+def process_nif_file_pyffi(path, keywords, rules, atomic=True):
+    """
+    Same as process_nif_file, but the whole file is read and written back by pyffi
+    """
+    found = False
+    modified = False
+    data = get_nif_format().Data()
+
+    try:
+        with profiling.stage("open"):
+            stream = open(path, 'rb')
+        with stream, profiling.stage("parse"):
+            data.read(stream)
+            profiling.count(read=stream.tell())
+    except Exception:
+        log.exception("Error while reading stream from file : " + path)
+        return status.FAILED
+
+    # First, let's get relevant NiTriShape block
+    block = None
+    index = 0
+    try:
+        root = data.roots[0]
+        with profiling.stage("find"):
+            while not block and index < len(keywords):
+                block = root.find(keywords[index])
+                index += 1
+
+        # Second, if found, change its parameters
+        if block is not None:
+            fields = rules.for_keyword(keywords[index - 1])
+            with profiling.stage("find"):
+                subblocks = list(block.tree())
+            for subblock in subblocks:
+                if subblock.__class__.__name__ == "BSLightingShaderProperty":
+                    found = True
+                    values = []
+                    changed = False
+                    for name, field_rules in fields:
+                        field = FIELDS[name]
+                        old_values = field.read_pyffi(subblock, name)
+                        # Values read from the file are 32 bits floats, as the ones returned by transform
+                        new_values = transform(field_rules, old_values)[0]
+                        if new_values == old_values:
+                            values.append(field.label + " " + format_values(old_values))
+                            continue
+                        field.write_pyffi(subblock, name, new_values)
+                        values.append(field.label + " " + format_values(old_values) + " -> " +
+                                      format_values(new_values))
+                        changed = True
+                    if changed:
+                        log.info("[" + path + "] ------ " + " | ".join(values))
+                        modified = True
+                    else:
+                        log.info("[" + path + "] ------ Unchanged : " + " | ".join(values))
+    except IndexError:
+        pass
+
+    if modified:
+        try:
+            with profiling.stage("serialize"):
+                content = io.BytesIO()
+                data.write(content)
+            with profiling.stage("write"):
+                if atomic:
+                    with AtomicFile(path) as file:
+                        with open(file.temp_path, 'wb') as stream:
+                            stream.write(content.getbuffer())
+                        file.commit()
+                else:
+                    with open(path, 'wb') as stream:
+                        stream.write(content.getbuffer())
+            profiling.count(written=len(content.getbuffer()))
+        except Exception:
+            log.exception("Error while writing to file : " + path)
+            return status.FAILED
+        return status.DONE
+    return status.UNCHANGED if found else status.FAILED
+
+
+def read_nif_file(path, keywords, nif_index=None):
+    """
+    Read the current values of the BSLightingShaderProperty blocks process_nif_file would modify, without modifying
+    anything.
+    :param nif_index: NifIndex built when scanning the file, or None
+    :return: tuple (keyword matching a block or None, list of (block index, dict field name -> tuple of values)),
+    or None if the file could not be read
+    """
+    try:
+        return read_shader_values(path, keywords, nif_index)
+    except (UnsupportedNifError, NifFormatError) as e:
+        log.debug("[" + path + "] - Falling back to pyffi : " + str(e))
+    except OSError:
+        log.exception("Error while reading file : " + path)
+        return None
+
+    data = get_nif_format().Data()
+    try:
+        with open(path, 'rb') as stream:
+            data.read(stream)
+        root = data.roots[0]
+    except Exception:
+        log.exception("Error while reading stream from file : " + path)
+        return None
+
+    for keyword in keywords:
+        block = root.find(keyword)
+        if block is not None:
+            indexes = {id(subblock): index for index, subblock in enumerate(data.blocks)}
+            return keyword, [(indexes[id(subblock)],
+                              {name: field.read_pyffi(subblock, name) for name, field in FIELDS.items()})
+                             for subblock in block.tree()
+                             if subblock.__class__.__name__ == "BSLightingShaderProperty"]
+    return None, []
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import csv
+import math
+import statistics
+
+from src.nif.rules import FIELDS
+
+HISTOGRAM_BINS = 10
+
+
+def value_columns():
+    """
+    :return: list of (column name, field name, component index), one per value of the fields of rules.FIELDS
+    """
+    columns = []
+    for name, field in FIELDS.items():
+        if field.components is None:
+            columns.append((name, name, 0))
+        else:
+            columns += [(name + "_" + component, name, index) for index, component in enumerate(field.components)]
+    return columns
+
+
+class ShaderReport:
+    """
+    Current values of the shader properties of a batch of files, one row per BSLightingShaderProperty, stored by
+    column so that statistics are computed on plain lists.
+    """
+
+    def __init__(self):
+        self.columns = value_columns()
+        self.paths = []
+        self.keywords = []
+        self.blocks = []
+        self.values = {column: [] for column, field, index in self.columns}
+        self.failed = []  # Files which could not be read
+        self.unmatched = []  # Files without block matching a keyword
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, path, result):
+        """
+        :param result: result of processing.read_nif_file
+        """
+        if result is None:
+            self.failed.append(path)
+            return
+        keyword, shaders = result
+        if not shaders:
+            self.unmatched.append(path)
+            return
+        for block, fields in shaders:
+            self.paths.append(path)
+            self.keywords.append(keyword.decode("ascii", "replace"))
+            self.blocks.append(block)
+            for column, field, index in self.columns:
+                self.values[column].append(fields[field][index])
+
+    def write_csv(self, path):
+        with open(path, "w", newline="") as stream:
+            writer = csv.writer(stream)
+            writer.writerow(["path", "keyword", "block"] + [column for column, field, index in self.columns])
+            for row in zip(self.paths, self.keywords, self.blocks,
+                           *[self.values[column] for column, field, index in self.columns]):
+                writer.writerow(row)
+
+    def statistics(self):
+        """
+        :return: dict keyword -> dict column -> dict of count, non_finite (NaN or infinite values, left out of the
+        others), min, max, mean and median (None without any finite value)
+        """
+        rows_by_keyword = {}
+        for row, keyword in enumerate(self.keywords):
+            rows_by_keyword.setdefault(keyword, []).append(row)
+
+        result = {}
+        for keyword, rows in sorted(rows_by_keyword.items()):
+            result[keyword] = {}
+            for column, field, index in self.columns:
+                values = [self.values[column][row] for row in rows]
+                finite = [value for value in values if math.isfinite(value)]
+                result[keyword][column] = {"count": len(values), "non_finite": len(values) - len(finite),
+                                           "min": None, "max": None, "mean": None, "median": None}
+                if finite:
+                    result[keyword][column].update(min=min(finite), max=max(finite), mean=statistics.mean(finite),
+                                                   median=statistics.median(finite))
+        return result
+
+    def histogram(self, column, bins=HISTOGRAM_BINS):
+        """
+        :return: list of (lower bound, upper bound, count), bins of the same width between minimum and maximum. NaN and
+        infinite values are left out, see non_finite.
+        """
+        values = [value for value in self.values[column] if math.isfinite(value)]
+        if not values:
+            return []
+        low, high = min(values), max(values)
+        if low == high:
+            return [(low, high, len(values))]
+        width = (high - low) / bins
+        counts = [0] * bins
+        for value in values:
+            counts[min(int((value - low) / width), bins - 1)] += 1
+        return [(low + width * index, low + width * (index + 1), count) for index, count in enumerate(counts)]
+
+    def non_finite(self, column):
+        """
+        :return: number of NaN or infinite values of column
+        """
+        return sum(1 for value in self.values[column] if not math.isfinite(value))
+
+    def summary(self, columns=("glossiness", "specular_strength")):
+        """
+        :return: text with the statistics of each keyword and the histograms of columns
+        """
+        lines = [str(len(self)) + " shader properties in " + str(len(set(self.paths))) + " files, " +
+                 str(len(self.unmatched)) + " files without keyword, " + str(len(self.failed)) + " unreadable"]
+        for keyword, keyword_statistics in self.statistics().items():
+            lines.append("")
+            lines.append(keyword + " (" + str(keyword_statistics[columns[0]]["count"]) + ")")
+            for column in columns:
+                values = keyword_statistics[column]
+                if values["min"] is None:
+                    line = "  {:<20} no finite value".format(column)
+                else:
+                    line = "  {:<20} min {:<10.4g} max {:<10.4g} mean {:<10.4g} median {:.4g}".format(
+                        column, values["min"], values["max"], values["mean"], values["median"])
+                if values["non_finite"]:
+                    line += " ({} not finite)".format(values["non_finite"])
+                lines.append(line)
+        for column in columns:
+            histogram = self.histogram(column)
+            non_finite = self.non_finite(column)
+            if not histogram and not non_finite:
+                continue
+            lines.append("")
+            lines.append(column)
+            largest = max([count for low, high, count in histogram] + [non_finite])
+            for low, high, count in histogram:
+                lines.append("  {:>10.4g} - {:<10.4g} {:>7} {}".format(low, high, count,
+                                                                       "#" * (40 * count // largest)))
+            if non_finite:
+                lines.append("  {:>23} {:>7} {}".format("not finite", non_finite, "#" * (40 * non_finite // largest)))
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {"rows": len(self), "failed": self.failed, "unmatched": self.unmatched,
+                "statistics": self.statistics(),
+                "histograms": {column: self.histogram(column) for column, field, index in self.columns},
+                "non_finite": {column: self.non_finite(column) for column, field, index in self.columns}}
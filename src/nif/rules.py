@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import struct
+
+
+class ShaderField:
+    """ Numeric field of a BSLightingShaderProperty, made of count 32 bits floats """
+
+    def __init__(self, label, offset, components=None):
+        """
+        :param offset: offset relative to the end of NiObjectNET fields
+        :param components: names of the components in pyffi, for fields made of several values
+        """
+        self.label = label
+        self.offset = offset
+        self.components = components
+        self.count = len(components) if components else 1
+        self.format = "<" + str(self.count) + "f"
+        self.size = 4 * self.count
+
+    def read_pyffi(self, shader, name):
+        value = getattr(shader, name)
+        if self.components is None:
+            return (value,)
+        return tuple(getattr(value, component) for component in self.components)
+
+    def write_pyffi(self, shader, name, values):
+        if self.components is None:
+            setattr(shader, name, values[0])
+        else:
+            value = getattr(shader, name)
+            for component, component_value in zip(self.components, values):
+                setattr(value, component, component_value)
+
+
+# Named as in pyffi
+FIELDS = {
+    "uv_offset": ShaderField("UV Offset", 8, ("u", "v")),
+    "uv_scale": ShaderField("UV Scale", 16, ("u", "v")),
+    "emissive_color": ShaderField("Emissive Color", 28, ("r", "g", "b")),
+    "emissive_multiple": ShaderField("Emissive Multiple", 40),
+    "alpha": ShaderField("Alpha", 48),
+    "refraction_strength": ShaderField("Refraction Strength", 52),
+    "glossiness": ShaderField("Glossiness", 56),
+    "specular_color": ShaderField("Specular Color", 60, ("r", "g", "b")),
+    "specular_strength": ShaderField("Specular Strength", 72),
+    "lighting_effect_1": ShaderField("Lighting Effect 1", 76),
+    "lighting_effect_2": ShaderField("Lighting Effect 2", 80),
+}
+# Names used by NifSkope and in htool.ini
+ALIASES = {
+    "specularstrength": "specular_strength",
+    "soft_lighting": "lighting_effect_1",
+    "rimlight_power": "lighting_effect_2",
+    "rim_light_power": "lighting_effect_2",
+}
+OPERATIONS = ("set", "scale", "clamp")
+
+
+class Rule:
+    """
+    Operation on a field of the BSLightingShaderProperty blocks below the block matching one of its keywords,
+    or any keyword if none is given.
+    set and scale take one value, or one per component of the field. clamp takes a minimum and a maximum.
+    """
+
+    def __init__(self, field, operation, values, keywords=()):
+        field = ALIASES.get(field.lower(), field.lower())
+        if field not in FIELDS:
+            raise ValueError("Unknown field " + field + ", expected one of " + ", ".join(sorted(FIELDS)))
+        if operation not in OPERATIONS:
+            raise ValueError("Unknown operation " + operation + ", expected one of " + ", ".join(OPERATIONS))
+        values = tuple(float(value) for value in values)
+        count = FIELDS[field].count
+        if operation == "clamp":
+            if len(values) != 2 or values[0] > values[1]:
+                raise ValueError("clamp of " + field + " expects a minimum and a maximum")
+        elif len(values) == 1:
+            values *= count
+        elif len(values) != count:
+            raise ValueError(operation + " of " + field + " expects 1 or " + str(count) + " values")
+
+        self.field = field
+        self.operation = operation
+        self.values = values
+        self.keywords = tuple(keywords)
+
+    def applies_to(self, keyword):
+        return not self.keywords or keyword in self.keywords
+
+    def apply(self, values):
+        """
+        :param values: current values of the field
+        :return: new values of the field
+        """
+        if self.operation == "set":
+            return self.values
+        if self.operation == "scale":
+            return tuple(value * factor for value, factor in zip(values, self.values))
+        minimum, maximum = self.values
+        return tuple(min(max(value, minimum), maximum) for value in values)
+
+    def to_dict(self):
+        rule = {"field": self.field, self.operation: list(self.values)}
+        if self.keywords:
+            rule["keywords"] = [keyword.decode("ascii") for keyword in self.keywords]
+        return rule
+
+    @staticmethod
+    def from_dict(rule):
+        """
+        :param rule: dict {"field": name, operation: value or list of values, "keywords": optional list}
+        """
+        operations = [operation for operation in OPERATIONS if operation in rule]
+        if "field" not in rule or len(operations) != 1:
+            raise ValueError("Invalid rule " + json.dumps(rule) + ", expected a field and one of " +
+                             ", ".join(OPERATIONS))
+        values = rule[operations[0]]
+        values = values if isinstance(values, list) else [values]
+        return Rule(rule["field"], operations[0], values,
+                    [keyword.encode("ascii") for keyword in rule.get("keywords", [])])
+
+    @staticmethod
+    def parse(field, text, keywords=()):
+        """
+        :param text: operation followed by its values, e.g. "scale 0.5" or "clamp 0 1". Several operations on the
+                     same field are separated by ";".
+        :return: list of Rule
+        """
+        rules = []
+        for operation in text.split(";"):
+            words = operation.replace(",", " ").split()
+            if not words:
+                continue
+            rules.append(Rule(field, words[0].lower(), words[1:], keywords))
+        return rules
+
+
+class RuleSet:
+    """
+    Rules applied to each relevant file, in order : a rule sees the values produced by the previous ones.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+
+    @staticmethod
+    def from_values(glossiness, specular_strength, rules=()):
+        """
+        :return: RuleSet setting glossiness and specular strength, followed by rules
+        """
+        return RuleSet([Rule("glossiness", "set", [glossiness]), Rule("specular_strength", "set", [specular_strength])]
+                       + list(rules))
+
+    def for_keyword(self, keyword):
+        """
+        :param keyword: keyword matching the block being modified
+        :return: list of (field name, list of Rule), in the order fields are first used
+        """
+        fields = {}
+        for rule in self.rules:
+            if rule.applies_to(keyword):
+                fields.setdefault(rule.field, []).append(rule)
+        return list(fields.items())
+
+    def to_list(self):
+        return [rule.to_dict() for rule in self.rules]
+
+
+def transform(rules, values):
+    """
+    Apply rules to the values of a field, rounded to 32 bits floats as stored in files
+    :return: tuple (new values, packed new values)
+    """
+    for rule in rules:
+        values = rule.apply(values)
+    packed = struct.pack("<" + str(len(values)) + "f", *values)
+    return struct.unpack("<" + str(len(values)) + "f", packed), packed
+
+
+def format_values(values):
+    return str(values[0]) if len(values) == 1 else "(" + ", ".join(str(value) for value in values) + ")"
+
+
+def load_rules(config, preset=None):
+    """
+    Read rules from section RULES of htool.ini (any keyword) and sections RULES:<keyword>, then from the JSON preset.
+    Each option is a field, e.g. "alpha = clamp 0 1", see Rule.parse.
+    :param preset: path of a JSON file {"rules": [rule, ...]}, see Rule.from_dict. Defaults to preset in section NIF.
+    :return: list of Rule
+    """
+    rules = []
+    defaults = config.defaults()
+    for section in config.sections():
+        if section != "RULES" and not section.startswith("RULES:"):
+            continue
+        keywords = [section[len("RULES:"):].strip().encode("ascii")] if section != "RULES" else []
+        for field in config.options(section):
+            if field not in defaults:
+                rules += Rule.parse(field, config.get(section, field), keywords)
+
+    preset = config.get("NIF", "preset", fallback="") if preset is None else preset
+    if preset:
+        with open(preset) as stream:
+            rules += [Rule.from_dict(rule) for rule in json.load(stream).get("rules", [])]
+    return rules
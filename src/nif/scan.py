@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import functools
+import io
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+from src.nif.bsa import ArchivedFile, BsaArchive, BsaError, find_archives, override_path
+from src.nif.header import NifFormatError, UnsupportedNifError, read_file_header, read_partial_header
+from src.nif.nif_format import get_nif_format
+from src.nif.patcher import index_nif_file
+from src.utils.scan_cache import ScanEntry
+
+log = logging.getLogger(__name__)
+
+SCAN_WORKERS = 8
+
+
+def find_nif_files(folder):
+    """
+    Traverse folder to find .nif files. Only names are checked, files are not opened.
+    :return: generator of (path, os.DirEntry)
+    """
+    directories = [folder]
+    while directories:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        # Same as os.walk : symbolic links to directories are not followed
+                        if not entry.is_symlink():
+                            directories.append(os.path.join(directory, entry.name))
+                    elif entry.name.endswith(".nif"):
+                        yield directory + "/" + entry.name, entry
+        except OSError:
+            log.exception("[" + directory + "] - Error")
+
+
+def scan_folder(folder, keywords, skip=(), cache=None, workers=SCAN_WORKERS):
+    """
+    Inspect every .nif file of a folder. Files are inspected by a pool of threads, and results are yielded as soon as
+    they are available, while the folder is still being traversed.
+    :param skip: paths to ignore (already scanned)
+    :param cache: ScanCache, to reuse results of previous scans. Only used from the calling thread.
+    :param workers: number of threads inspecting files
+    :return: generator of (path, ScanEntry)
+    """
+    if cache is not None:
+        cache.load(folder)
+
+    paths = set()
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path, dir_entry in find_nif_files(folder):
+            paths.add(path)
+            if path in skip:
+                continue
+
+            try:
+                stat = dir_entry.stat()
+            except OSError:
+                log.exception("[" + path + "] - Error")
+                continue
+
+            entry = None if cache is None else cache.get(path, stat.st_size, stat.st_mtime_ns)
+            # Blocks to patch depend on keywords : files are inspected again when keywords change
+            if entry is not None and entry.keywords == b",".join(keywords):
+                yield path, entry
+                continue
+
+            pending[executor.submit(inspect_nif_file, path, keywords)] = (path, stat)
+            # Bound the number of queued files, and stream the results already available
+            done, _ = wait(pending, timeout=0 if len(pending) < 4 * workers else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield _scan_result(pending.pop(future), future.result(), cache)
+
+        for future in as_completed(list(pending)):
+            yield _scan_result(pending.pop(future), future.result(), cache)
+
+    if cache is not None:
+        cache.evict(folder, paths)
+
+
+def _scan_result(file, entry, cache):
+    path, stat = file
+    if cache is not None:
+        cache.put(path, stat.st_size, stat.st_mtime_ns, entry)
+    return path, entry
+
+
+def inspect_nif_file(path, keywords):
+    """
+    Check if a file is relevant, i.e. its root is a NiNode, and one of its strings is a keyword. Blocks to patch in
+    relevant files are located at the same time.
+    :return: ScanEntry
+    """
+    # Only the header is read, pyffi is only used for headers which can't be read that way
+    try:
+        header = read_file_header(path)
+    except UnsupportedNifError as e:
+        log.debug("[" + path + "] - Inspecting with pyffi : " + str(e))
+        return _inspect_pyffi(path, keywords)
+    except Exception:
+        log.exception("[" + path + "] - Error")
+        return ScanEntry(None, [], b",".join(keywords), False)
+
+    if not header.block_types:
+        log.error("[" + path + "] - No block")
+        return ScanEntry(None, [], b",".join(keywords), False)
+
+    entry = _match(header.block_types[0], header.strings, keywords)
+    if entry.result():
+        try:
+            entry.nif_index = index_nif_file(path, keywords, header)
+        except (UnsupportedNifError, NifFormatError) as e:
+            log.debug("[" + path + "] - Not indexed : " + str(e))
+        except OSError:
+            log.exception("[" + path + "] - Error")
+    return entry
+
+
+def scan_archives(folder, keywords, skip=()):
+    """
+    Inspect the .nif files stored in the .bsa archives of a folder, without extracting them. Files overridden by a
+    loose file are left out : the game uses the loose file. If several archives contain the same file, the first one
+    wins.
+    :param skip: paths of loose files to ignore (already scanned)
+    :return: generator of (path of the loose file which would override it, ScanEntry, ArchivedFile)
+    """
+    found = set()
+    for archive_path in find_archives(folder):
+        try:
+            with BsaArchive(archive_path) as archive:
+                log.info("Scanning archive : " + archive_path + " (" + str(len(archive.entries)) + " files)")
+                for bsa_entry in archive.entries:
+                    if not bsa_entry.path.endswith(".nif"):
+                        continue
+                    path = override_path(archive_path, bsa_entry)
+                    if path in skip or path in found or os.path.exists(path):
+                        continue
+                    found.add(path)
+                    name = archive_path + "/" + bsa_entry.path
+                    entry = inspect_nif_content(name, functools.partial(archive.read, bsa_entry), keywords)
+                    yield path, entry, ArchivedFile(archive_path, bsa_entry.path)
+        except (OSError, BsaError):
+            log.exception("[" + archive_path + "] - Error")
+
+
+def inspect_nif_content(name, read, keywords):
+    """
+    Same as inspect_nif_file, for a file which is not on disk (e.g. in an archive). Only its beginning is read, unless
+    pyffi is needed. Blocks to patch are not located : they will be once the file is extracted.
+    :param name: name of the file, for logs
+    :param read: function(size=None) returning the first size bytes of the file, or all of it
+    :return: ScanEntry
+    """
+    try:
+        header = read_partial_header(read)
+    except UnsupportedNifError as e:
+        log.debug("[" + name + "] - Inspecting with pyffi : " + str(e))
+        try:
+            content = read()
+        except Exception:
+            log.exception("[" + name + "] - Error")
+            return ScanEntry(None, [], b",".join(keywords), False)
+        return _inspect_pyffi(name, keywords, content)
+    except Exception:
+        log.exception("[" + name + "] - Error")
+        return ScanEntry(None, [], b",".join(keywords), False)
+
+    if not header.block_types:
+        log.error("[" + name + "] - No block")
+        return ScanEntry(None, [], b",".join(keywords), False)
+    return _match(header.block_types[0], header.strings, keywords)
+
+
+def _inspect_pyffi(path, keywords, content=None):
+    data = get_nif_format().Data()
+    try:
+        with (open(path, "rb") if content is None else io.BytesIO(content)) as stream:
+            data.inspect(stream)
+        return _match(data.header.block_types[0], data.header.strings, keywords)
+    except ValueError:
+        log.exception("[" + path + "] - Too Big to inspect - skipping")
+    except Exception:
+        log.exception("[" + path + "] - Error")
+    return ScanEntry(None, [], b",".join(keywords), False)
+
+
+def _match(root_type, strings, keywords):
+    return ScanEntry(root_type, list(strings), b",".join(keywords),
+                     any(keyword in keywords for keyword in strings))
@@ -1,28 +1,212 @@
+import bisect
 import os
+from array import array
 
-from PySide2.QtCore import Qt
-from PySide2.QtWidgets import QListWidget, QAbstractItemView
+from PySide2.QtCore import Qt, QAbstractListModel, QItemSelection, QItemSelectionModel, QModelIndex
+from PySide2.QtWidgets import QListView, QAbstractItemView
 
+from src.utils import status
 
-class NifList(QListWidget):
+STATUS_COLORS = {
+    status.PROCESSING: Qt.blue,
+    status.DONE: Qt.darkGreen,
+    status.UNCHANGED: Qt.darkCyan,
+    status.FAILED: Qt.darkRed,
+    status.IGNORED: Qt.darkRed
+}
+
+MAX_INSERTED_RUNS = 32  # runs of rows inserted one by one by add_paths, above which the model is reset
+
+
+class NifListModel(QAbstractListModel):
+    """
+    Sorted list of paths, with the status of each file. Paths and statuses are kept in two parallel arrays, rather
+    than one item object per file.
+    """
+
+    def __init__(self, parent):
+        super(NifListModel, self).__init__(parent)
+        self.paths = []
+        self.statuses = array('B')
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.paths[index.row()]
+        if role == Qt.ForegroundRole:
+            return STATUS_COLORS.get(self.statuses[index.row()])
+        return None
+
+    def add_paths(self, paths, file_status=status.NONE):
+        """
+        Insert paths at their sorted position, in one batch. Paths already present are ignored.
+        Paths inserted next to each other are inserted as one run of rows. A batch scattered in many runs resets the
+        model instead, rather than moving the rest of the list once per run : NifList selects its selected paths again.
+        """
+        runs = []  # [position in the current list, paths inserted there]
+        for path in sorted(set(paths)):
+            position = bisect.bisect_left(self.paths, path)
+            if position < len(self.paths) and self.paths[position] == path:
+                continue
+            if runs and runs[-1][0] == position:
+                runs[-1][1].append(path)
+            else:
+                runs.append([position, [path]])
+        if not runs:
+            return
+
+        if len(runs) > MAX_INSERTED_RUNS:
+            self.beginResetModel()
+            new_paths = []
+            new_statuses = array('B')
+            start = 0
+            for position, run in runs:
+                new_paths += self.paths[start:position]
+                new_paths += run
+                new_statuses += self.statuses[start:position]
+                new_statuses += array('B', [file_status]) * len(run)
+                start = position
+            self.paths = new_paths + self.paths[start:]
+            self.statuses = new_statuses + self.statuses[start:]
+            self.endResetModel()
+            return
+
+        inserted = 0
+        for position, run in runs:
+            row = position + inserted
+            self.beginInsertRows(QModelIndex(), row, row + len(run) - 1)
+            self.paths[row:row] = run
+            self.statuses[row:row] = array('B', [file_status]) * len(run)
+            self.endInsertRows()
+            inserted += len(run)
+
+    def remove_rows(self, rows):
+        rows = set(rows)
+        self.beginResetModel()
+        self.paths = [path for row, path in enumerate(self.paths) if row not in rows]
+        self.statuses = array('B', (file_status for row, file_status in enumerate(self.statuses) if row not in rows))
+        self.endResetModel()
+
+    def clear(self):
+        self.beginResetModel()
+        self.paths = []
+        self.statuses = array('B')
+        self.endResetModel()
+
+    def set_status(self, row, file_status):
+        self.statuses[row] = file_status
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.ForegroundRole])
+
+    def set_statuses(self, changes):
+        """
+        :param changes: list of (row, status), repainted at once
+        """
+        for row, file_status in changes:
+            self.statuses[row] = file_status
+        rows = [row for row, file_status in changes]
+        self.dataChanged.emit(self.index(min(rows)), self.index(max(rows)), [Qt.ForegroundRole])
+
+
+class NifList(QListView):
     def __init__(self, parent):
         super(NifList, self).__init__(parent)
 
+        self.setModel(NifListModel(self))
+        self.setUniformItemSizes(True)
         self.setSelectionMode(QAbstractItemView.MultiSelection)
         self.setAlternatingRowColors(True)
-        self.setStyleSheet("QListWidget {padding: 10px;} QListWidget::item { margin: 10px; }")
-        self.setSortingEnabled(True)
-        self.itemDoubleClicked.connect(self._open_file_location)
+        self.setStyleSheet("QListView {padding: 10px;} QListView::item { margin: 10px; }")
+        self.doubleClicked.connect(self._open_file_location)
+        # Resetting the model (many paths added, rows removed) clears the selection : selected paths are selected again
+        self.selected_paths = []
+        self.current_path = None
+        self.model().modelAboutToBeReset.connect(self._save_selection)
+        self.model().modelReset.connect(self._restore_selection)
+
+    def count(self):
+        return self.model().rowCount()
+
+    def path(self, row):
+        return self.model().paths[row]
+
+    def paths(self):
+        return self.model().paths
+
+    def row(self, path):
+        """
+        :return: row of path, which must be in the list
+        """
+        return bisect.bisect_left(self.model().paths, path)
+
+    def find_row(self, path):
+        """
+        :return: row of path, None if it is not in the list
+        """
+        row = self.row(path)
+        if row < self.count() and self.path(row) == path:
+            return row
+        return None
+
+    def add_paths(self, paths, file_status=status.NONE):
+        self.model().add_paths(paths, file_status)
+
+    def remove_paths(self, paths):
+        """
+        Remove paths which are in the list, others are ignored
+        """
+        rows = [row for row in map(self.find_row, paths) if row is not None]
+        if rows:
+            self.model().remove_rows(rows)
+
+    def selected_rows(self):
+        return sorted(index.row() for index in self.selectionModel().selectedRows())
+
+    def set_status(self, row, file_status):
+        self.model().set_status(row, file_status)
+
+    def set_statuses(self, changes):
+        if changes:
+            self.model().set_statuses(changes)
+
+    def clear(self):
+        self.model().clear()
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Delete:
             self._del_item()
 
-    def _del_item(self):
-        for item in self.selectedItems():
-            self.takeItem(self.row(item))
+    def _save_selection(self):
+        self.selected_paths = [self.path(row) for row in self.selected_rows()]
+        current = self.currentIndex()
+        self.current_path = self.path(current.row()) if current.isValid() else None
+
+    def _restore_selection(self):
+        rows = sorted(row for row in map(self.find_row, self.selected_paths) if row is not None)
+        selection = QItemSelection()
+        start = None
+        for position, row in enumerate(rows):
+            if start is None:
+                start = row
+            if position + 1 == len(rows) or rows[position + 1] != row + 1:
+                selection.select(self.model().index(start), self.model().index(row))
+                start = None
+        if not selection.isEmpty():
+            self.selectionModel().select(selection, QItemSelectionModel.Select)
+        current = None if self.current_path is None else self.find_row(self.current_path)
+        if current is not None:
+            self.selectionModel().setCurrentIndex(self.model().index(current), QItemSelectionModel.NoUpdate)
+        self.selected_paths = []
+        self.current_path = None
 
-    @staticmethod
-    def _open_file_location(item):
-        os.startfile(item.text(), 'open')
+    def _del_item(self):
+        self.model().remove_rows(self.selected_rows())
 
+    def _open_file_location(self, index):
+        os.startfile(self.path(index.row()), 'open')
@@ -1,21 +1,40 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import collections
 import itertools
+import logging
+import time
 
-from PySide2.QtCore import QThreadPool, Qt, QSize
+from PySide2.QtCore import QThreadPool, Qt, QSize, QTimer
 from PySide2.QtWidgets import QHBoxLayout, QVBoxLayout, QDoubleSpinBox, QFileDialog, QProgressBar, QMessageBox, \
-    QListWidget, QSplitter, QWidget, QListWidgetItem
-from pyffi.formats.nif import *
+    QSplitter, QWidget
 
+from src.nif.processing import read_nif_file
+from src.nif.report import ShaderReport
+from src.nif.rules import RuleSet, load_rules
+from src.nif.scan import SCAN_WORKERS, scan_archives, scan_folder
 from src.pyqt import QuickyGui
 from src.pyqt.MainWindow import MainWindow
 from src.pyqt.NifBatchTools.ListWidget import NifList
-from src.pyqt.Worker import NifProcessWorker, Worker
+from src.pyqt.Worker import NifProcessPoolWorker, NifThreadPoolWorker, NifWatchWorker, Worker
+from src.utils import status
+from src.utils.backup import BackupStore
 from src.utils.config import CONFIG, save_config, get_config
+from src.utils.journal import Journal
+from src.utils.profiling import DEFAULT_PROFILE_FOLDER, BatchStats, format_duration, merge_profiles
+from src.utils.scan_cache import ScanCache
+from src.utils.scheduler import JobController
+from src.utils.status_table import StatusTable
 
 log = logging.getLogger(__name__)
 
+UPDATE_INTERVAL = 100 # ms, between two updates of the lists while scanning
+SCAN_BATCH_INTERVAL = 0.05 # s, between two batches of results posted by the scanning thread
+UPDATE_SLOWDOWN = 100 # files, for each additional ms between two updates of the lists
+STATS_INTERVAL = 0.5 # s, between two updates of the statistics while applying
+STATUS_INTERVAL = 100 # ms, between two reads of the status table while applying
+
 
 class NifBatchTools(MainWindow):
 
@@ -25,10 +44,18 @@ class NifBatchTools(MainWindow):
 
         self.source_folder = CONFIG.get("DEFAULT", "SourceFolder")
         self.keywords = list(map(lambda x: x.encode("ascii"), CONFIG.get("NIF", "keywords").replace(" ", "").split(",")))
-        self.nif_files = set() # improve performance (better to check in a set rather than in a QListWidget
-        self.ignored_nif_files = set() # improve performance (better to check in a set rather than in a QListWidget
         self.setSize(QSize(700, 600))
-        self.processed_files = itertools.count()
+        self.status_table = None # StatusTable of the last apply, written by the workers
+        self.status_snapshot = b"" # statuses of the status table when last repainted
+        self.apply_paths = [] # paths of the last apply, by index in the status table : rows may be removed meanwhile
+        self.scan_results = collections.deque() # batches of (path, ScanEntry, ArchivedFile or None) posted by the scanning thread
+        self.nif_indexes = {} # path -> NifIndex built when scanning, so that applying does not search blocks again
+        self.nif_archived = {} # path -> ArchivedFile of relevant files only in a .bsa archive, extracted when applying
+        self.report = None # ShaderReport of the last report
+        self.stats = None # BatchStats of the last apply
+        self.last_stats_update = 0
+        self.watch_worker = None # NifWatchWorker while watching the source folder
+        self.controller = None # JobController of the running apply
 
         log.info("Source folder  : " + self.source_folder)
         log.info("Keywords       : " + str(self.keywords))
@@ -62,13 +89,28 @@ class NifBatchTools(MainWindow):
 
         self.nif_files_list_widget = NifList(self)
         self.ignored_nif_files_list_widget = NifList(self)
+
+        # Timings of the last apply
+        self.label_stats = QuickyGui.create_label(self, "")
+
+        # Lists are updated at a regular rate while scanning, rather than for each file
+        self.update_timer = QTimer(self)
+        self.update_timer.setInterval(UPDATE_INTERVAL)
+        self.update_timer.timeout.connect(self.update_nif_files)
         self.update_nif_files()
 
+        # Statuses are read from the status table at a regular rate while applying, rather than signaled for each file
+        self.status_timer = QTimer(self)
+        self.status_timer.setInterval(STATUS_INTERVAL)
+        self.status_timer.timeout.connect(self.update_statuses)
+
         self.group_box_legends = QuickyGui.create_group_box(self, "Legends")
         instructions_4 = QuickyGui.create_label(self, "Green - File correctly processed\n")
         instructions_4.setStyleSheet("QLabel { color : darkGreen; font-weight : bold }")
         instructions_5 = QuickyGui.create_label(self, "Blue - File is processing\n")
         instructions_5.setStyleSheet("QLabel { color : darkBlue; font-weight : bold }")
+        instructions_unchanged = QuickyGui.create_label(self, "Cyan - File already had these values, not written\n")
+        instructions_unchanged.setStyleSheet("QLabel { color : darkCyan; font-weight : bold }")
         instructions_6 = QuickyGui.create_label(self, "Red - File ignored/with errors.")
         instructions_6.setStyleSheet("QLabel { color : darkRed; font-weight : bold }")
         instructions_7 = QuickyGui.create_label(self, "Reasons : "
@@ -81,6 +123,7 @@ class NifBatchTools(MainWindow):
         vbox.setSpacing(5)
         vbox.addWidget(instructions_4)
         vbox.addWidget(instructions_5)
+        vbox.addWidget(instructions_unchanged)
         vbox.addWidget(instructions_6)
         vbox.addWidget(instructions_7)
 
@@ -101,6 +144,7 @@ class NifBatchTools(MainWindow):
         vbox.addItem(hbox)
 
         vbox.addWidget(self.ignored_nif_files_list_widget)
+        vbox.addWidget(self.label_stats)
         vbox.addWidget(self.group_box_legends)
 
         self.group_box_details.setLayout(vbox)
@@ -110,7 +154,7 @@ class NifBatchTools(MainWindow):
         self.group_box_instructions = QuickyGui.create_group_box(self, "Instructions")
 
         instructions_1 = QuickyGui.create_label(self, "I. By clicking on \"Scan Folder\", all .nif contained in this folder (subfolders and so on), will be added to the set of files to be processed. You can scan multiple folder, by clicking again. All files not already present will be added.")
-        instructions_2 = QuickyGui.create_label(self, "II. Once your desired parameters are set, click on \"Apply\". Bewary, the process is quite slow (just opening the file is quite consuming somehow)")
+        instructions_2 = QuickyGui.create_label(self, "II. Once your desired parameters are set, click on \"Apply\". The time left is estimated from the files already processed, below the lists.")
 
         vbox = QVBoxLayout()
         vbox.setSpacing(5)
@@ -171,13 +215,46 @@ class NifBatchTools(MainWindow):
         self.group_box_apply = QuickyGui.create_group_box(self, "STEP III - Apply")
 
         button_load_files = QuickyGui.create_button(self, "Apply", self.action_apply)
+        button_report = QuickyGui.create_button(self, "Report", self.action_report)
+        button_restore_backup = QuickyGui.create_button(self, "Restore last backup", self.action_restore_backup)
 
         hbox = QHBoxLayout()
         hbox.addWidget(button_load_files)
+        hbox.addWidget(button_report)
+        hbox.addWidget(button_restore_backup)
 
         self.group_box_apply.setLayout(hbox)
         left_v_box.addWidget(self.group_box_apply)
 
+        # ===== Running batch =====
+        self.group_box_batch = QuickyGui.create_group_box(self, "Running batch")
+
+        self.button_pause = QuickyGui.create_button(self, "Pause", self.action_pause)
+        button_cancel = QuickyGui.create_button(self, "Cancel", self.action_cancel)
+        button_prioritize = QuickyGui.create_button(self, "Process selected first", self.action_prioritize)
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(self.button_pause)
+        hbox.addWidget(button_cancel)
+        hbox.addWidget(button_prioritize)
+
+        self.group_box_batch.setLayout(hbox)
+        self.group_box_batch.setEnabled(False)
+        left_v_box.addWidget(self.group_box_batch)
+
+        # ===== Watch =====
+        self.group_box_watch = QuickyGui.create_group_box(self, "Watch source folder")
+
+        self.button_watch = QuickyGui.create_button(self, "Watch", self.action_watch)
+        label_watch = QuickyGui.create_label(self, "New or modified .nif files (e.g. built by BodySlide) are processed as soon as they are written.")
+
+        vbox = QVBoxLayout()
+        vbox.addWidget(label_watch)
+        vbox.addWidget(self.button_watch)
+
+        self.group_box_watch.setLayout(vbox)
+        left_v_box.addWidget(self.group_box_watch)
+
         # ===== Finalizing =====
         self.progress_bar = QProgressBar(self)
         left_v_box.addWidget(self.progress_bar)
@@ -189,14 +266,39 @@ class NifBatchTools(MainWindow):
         self.group_box_parameters.setEnabled(value)
         self.group_box_load_files.setEnabled(value)
         self.group_box_apply.setEnabled(value)
+        self.group_box_watch.setEnabled(value)
 
     def update_nif_files(self, value=0):
+        """
+        Add results posted by the scanning thread since last update, in one batch per list
+        """
+        nif_files = []
+        ignored_nif_files = []
+        while self.scan_results:
+            for path, entry, archived_file in self.scan_results.popleft():
+                result = entry.result()
+                if result:
+                    nif_files.append(path)
+                    if entry.nif_index is not None:
+                        self.nif_indexes[path] = entry.nif_index
+                    if archived_file is not None:
+                        self.nif_archived[path] = archived_file
+                elif result is not None:
+                    ignored_nif_files.append(path)
+
+        if nif_files:
+            self.nif_files_list_widget.add_paths(nif_files)
+        if ignored_nif_files:
+            self.ignored_nif_files_list_widget.add_paths(ignored_nif_files, status.IGNORED)
+
+        count = self.nif_files_list_widget.count() + self.ignored_nif_files_list_widget.count()
         self.lcd_nif_files_loaded.display(self.nif_files_list_widget.count())
         self.lcd_nif_files_ignored.display(self.ignored_nif_files_list_widget.count())
-        self.nif_files_list_widget.sortItems()
-        self.ignored_nif_files_list_widget.sortItems()
+        # Each update lays the lists out again : update less often as they grow, to keep the GUI responsive
+        self.update_timer.setInterval(UPDATE_INTERVAL + count // UPDATE_SLOWDOWN)
 
     def finish_action(self):
+        self.progress_bar.setFormat("%p%")
         self.progress_bar.setMinimum(0)
         self.progress_bar.setMaximum(max(1, self.nif_files_list_widget.count()))
         self.progress_bar.setValue(self.nif_files_list_widget.count())
@@ -204,32 +306,68 @@ class NifBatchTools(MainWindow):
         log.info("Done !")
 
     def finish_load_action(self, result):
+        self.update_timer.stop()
+        self.update_nif_files()
         self.finish_action()
         QMessageBox.information(self, "Results", "Done !\n\n" + str(self.nif_files_list_widget.count()) + " .nif file(s) loaded.\n" + str(result) + " .nif files ignored.")
 
-    def start_apply_action(self, index):
-        item = self.nif_files_list_widget.item(index)
-        item.setForeground(Qt.blue)
-
-    def result_apply_action(self, index, result):
-        item = self.nif_files_list_widget.item(index)
-        if result:
-            item.setForeground(Qt.darkGreen)
-        else:
-            item.setForeground(Qt.darkRed)
-        self.progress_bar.setValue(next(self.processed_files)+1)
+    def update_statuses(self):
+        """
+        Repaint files whose status has changed in the status table since last update, in one batch
+        """
+        self.status_snapshot, changes = self.status_table.changes(self.status_snapshot)
+        if changes:
+            rows = []
+            for index, result in changes:
+                path = self.apply_paths[index]
+                if result == status.DONE and self.nif_archived:
+                    # Now a loose file
+                    self.nif_archived.pop(path, None)
+                row = self.nif_files_list_widget.find_row(path)
+                if row is not None:
+                    rows.append((row, result))
+            self.nif_files_list_widget.set_statuses(rows)
+            self.progress_bar.setValue(StatusTable.finished(self.status_snapshot))
+        if time.monotonic() - self.last_stats_update >= STATS_INTERVAL:
+            self.update_stats()
+
+    def update_stats(self):
+        self.last_stats_update = time.monotonic()
+        if self.stats is not None and self.stats.files:
+            self.label_stats.setText(self.stats.summary())
+            remaining = self.stats.remaining()
+            if remaining is not None and self.stats.files < self.stats.total:
+                self.progress_bar.setFormat("%p% - about " + format_duration(remaining) + " left")
+            else:
+                self.progress_bar.setFormat("%p%")
 
     def finish_apply_action(self):
-        if self.progress_bar.value() == self.nif_files_list_widget.count():
-            self.finish_action()
-            QMessageBox.information(self, "Results", "Done !\n\n" + str(self.progress_bar.value()) + " .nif file(s) loaded.\n")
+        self.status_timer.stop()
+        self.update_statuses()
+        apply_statuses = collections.Counter(self.status_snapshot)
+        self.label_stats.setText(self.stats.summary())
+        log.info(self.stats.summary())
+        for duration, index in self.status_table.slowest(5):
+            log.info("Slowest file : " + self.apply_paths[index] + " ({:.2f} s, {:.1f} MB written)".format(
+                duration, self.status_table.written[index] / 1e6))
+        if self.stats.profile_folder is not None:
+            log.info("Profile of the batch : " + merge_profiles(self.stats.profile_folder,
+                                                                self.stats.profile_folder + ".prof"))
+        self.finish_action()
+        self.controller = None
+        self.group_box_batch.setEnabled(False)
+        self.button_pause.setText("Pause")
+        QMessageBox.information(self, "Results", "Done !\n\n" + str(apply_statuses[status.DONE]) + " .nif file(s) processed.\n"
+                                + str(apply_statuses[status.UNCHANGED]) + " .nif file(s) unchanged.\n"
+                                + str(apply_statuses[status.FAILED]) + " .nif file(s) with errors.\n"
+                                + str(apply_statuses[status.NONE]) + " .nif file(s) cancelled.\n")
 
     def action_clear_files(self):
         log.info("Clearing loaded .nif files ...")
         self.nif_files_list_widget.clear()
         self.ignored_nif_files_list_widget.clear()
-        self.nif_files.clear()
-        self.ignored_nif_files.clear()
+        self.nif_indexes.clear()
+        self.nif_archived.clear()
         self.update_nif_files()
         self.progress_bar.reset()
 
@@ -255,48 +393,57 @@ class NifBatchTools(MainWindow):
             CONFIG.set("DEFAULT", "SourceFolder", self.source_folder),
             save_config()
 
-        worker = Worker(self.load_files)
-        worker.signals.progress.connect(self.update_nif_files)
+        # Files already loaded are not scanned again
+        skip = set(self.nif_files_list_widget.paths())
+        skip.update(self.ignored_nif_files_list_widget.paths())
+        worker = Worker(self.load_files, skip)
         worker.signals.result.connect(self.finish_load_action)
+        self.update_timer.start()
 
         QThreadPool.globalInstance().start(worker)
 
-    def load_files(self, progress_callback):
+    def load_files(self, skip, progress_callback):
         """
-        Traverse folder to find .nif files
+        Traverse folder to find .nif files, then its .bsa archives if enabled in htool.ini. Results are posted by
+        batches to scan_results, and added to the lists by the GUI thread (see update_nif_files).
         """
         ignored_files = 0
-        for root, dirs, files in os.walk(self.source_folder):
-            for file in files:
-                path = root + "/" + file
-                if file.endswith(".nif") and path not in self.nif_files and path not in self.ignored_nif_files:
-                    stream = open(path, "rb")
-                    data = NifFormat.Data()
-                    success = False
-                    add_to_ignored_list = False
-                    try:
-                        data.inspect(stream)
-                        if "NiNode".encode('ascii') == data.header.block_types[0]:
-                            if any(keyword in self.keywords for keyword in data.header.strings):
-                                success = True
-                            else:
-                                add_to_ignored_list = True
-
-                    except ValueError:
-                        log.exception("[" + file + "] - Too Big to inspect - skipping")
-                    except Exception:
-                        log.exception("[" + file + "] - Error")
-                    finally:
-                        if success:
-                            self.nif_files.add(path)
-                            self.nif_files_list_widget.addItem(path)
-                        elif add_to_ignored_list:
-                            item = QListWidgetItem(path, self.ignored_nif_files_list_widget)
-                            item.setForeground(Qt.darkRed)
-                            ignored_files += 1
-                    progress_callback.emit(0) # emit parameter is not used
+        scanned_files = 0
+        batch = []
+        start = last_post = time.monotonic()
+        cache = ScanCache() if get_config().getboolean("SCAN", "cache", fallback=True) else None
+        files = scan_folder(self.source_folder, self.keywords, skip, cache,
+                            get_config().getint("SCAN", "workers", fallback=SCAN_WORKERS))
+        loose_files = set(skip)
+        try:
+            for path, entry, archived_file in itertools.chain(((path, entry, None) for path, entry in files),
+                                                              self.scan_archived_files(loose_files)):
+                batch.append((path, entry, archived_file))
+                loose_files.add(path)
+                scanned_files += 1
+                if entry.result() is False:
+                    ignored_files += 1
+                if time.monotonic() - last_post >= SCAN_BATCH_INTERVAL:
+                    self.scan_results.append(batch)
+                    batch = []
+                    last_post = time.monotonic()
+        finally:
+            self.scan_results.append(batch)
+            if cache is not None:
+                cache.close()
+        elapsed = max(time.monotonic() - start, 1e-9)
+        log.info("Scanned " + str(scanned_files) + " files in " + format(elapsed, ".2f") + " s (" +
+                 format(scanned_files / elapsed, ".1f") + " files/s)")
         return ignored_files
 
+    def scan_archived_files(self, skip):
+        """
+        :param skip: paths already scanned, filled while loose files are scanned
+        :return: generator of (path, ScanEntry, ArchivedFile) of the files of the archives of the source folder
+        """
+        if get_config().getboolean("SCAN", "archives", fallback=False):
+            yield from scan_archives(self.source_folder, self.keywords, skip)
+
     def action_apply(self):
         """
         Apply parameters to relevant .nif files
@@ -306,38 +453,221 @@ class NifBatchTools(MainWindow):
             return
 
 
-        if self.nif_files_list_widget.count() >= get_config().getint("DEFAULT", "softLimit"):
-            box = QMessageBox()
-            box.setIcon(QMessageBox.Question)
-            box.setWindowTitle('Are you sure ?')
-            box.setText("The tool may struggle with more than 100 .nif files at once. We advise you to process small batches.\n\nAre you sure you wish to continue ?")
-            box.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
-            buttonY = box.button(QMessageBox.Yes)
-            buttonY.setText('Yes')
-            buttonN = box.button(QMessageBox.No)
-            buttonN.setText('No')
-            box.exec_()
-
-            if box.clickedButton() == buttonN:
-                return
+        rules = self.get_rules()
+        if rules is None:
+            return
 
         log.info("Applying parameters to " + str(self.nif_files_list_widget.count()) + " files ...")
         self.toggle(False)
+        self.apply_paths = list(self.nif_files_list_widget.paths())
+        # Rows may have been added since the last scan (e.g. by watching the folder)
+        self.progress_bar.setMinimum(0)
+        self.progress_bar.setMaximum(max(1, len(self.apply_paths)))
         self.progress_bar.setValue(0)
-        self.processed_files = itertools.count()
+        self.status_table = StatusTable(len(self.apply_paths))
+        self.status_snapshot = b""
 
         CONFIG.set("NIF", "Glossiness", str(self.spin_box_glossiness.value())),
         CONFIG.set("NIF", "SpecularStrength", str(self.spin_box_specular_strength.value())),
         save_config()
 
-        QMessageBox.warning(self, "Attention !", "The process is quite slow.\n\nThe gui will be mostly unresponsive to your input. Don't close the application, unless the completion pourcentage has not been updated in a long time (several minutes).\nIt took me 13 minutes to process 100 files for example.")
-
-        #for indices in chunkify(range(self.nif_files_list_widget.count()), QThreadPool.globalInstance().maxThreadCount()-1):
         QThreadPool.globalInstance().setExpiryTimeout(-1)
-        for index in range(self.nif_files_list_widget.count()):
-            item = self.nif_files_list_widget.item(index)
-            worker = NifProcessWorker(index=index, path=item.text(), keywords=self.keywords, glossiness=self.spin_box_glossiness.value(), specular_strength=self.spin_box_specular_strength.value())
-            worker.signals.start.connect(self.start_apply_action)
-            worker.signals.result.connect(self.result_apply_action)
-            worker.signals.finished.connect(self.finish_apply_action)
-            QThreadPool.globalInstance().start(worker)
+        jobs = list(enumerate(self.apply_paths))
+        if get_config().get("APPLY", "backend", fallback="process") == "process":
+            worker_class = NifProcessPoolWorker
+        else:
+            worker_class = NifThreadPoolWorker
+        backup = BackupStore() if get_config().getboolean("APPLY", "backup", fallback=False) else None
+        journal = None
+        if get_config().getboolean("APPLY", "journal", fallback=True):
+            journal = Journal(self.keywords, rules)
+        if self.stats is not None and self.stats.files:
+            # Until files of this batch are done, from the throughput of the last one
+            self.label_stats.setText("About " + format_duration(self.nif_files_list_widget.count() / self.stats.rate()) +
+                                     " for " + str(self.nif_files_list_widget.count()) + " files, at the speed of the last batch")
+        else:
+            self.label_stats.setText("")
+        profile = get_config().getboolean("APPLY", "profile", fallback=False)
+        self.stats = BatchStats(DEFAULT_PROFILE_FOLDER if profile else None)
+        self.controller = JobController()
+        self.group_box_batch.setEnabled(True)
+        worker = worker_class(jobs, self.keywords, rules, self.status_table, workers=get_config().getint("APPLY", "workers", fallback=0), indexes=self.nif_indexes,
+                              atomic=get_config().get("APPLY", "write", fallback="atomic") != "inplace", backup=backup,
+                              journal=journal, stats=self.stats, controller=self.controller, archived=dict(self.nif_archived))
+        worker.signals.finished.connect(self.finish_apply_action)
+        self.status_timer.start()
+        QThreadPool.globalInstance().start(worker)
+
+    def action_pause(self):
+        """
+        Stop or start again processing files of the running batch. Files being processed finish.
+        """
+        if self.controller is None:
+            return
+        if self.controller.paused():
+            log.info("Resuming ...")
+            self.controller.resume()
+            self.button_pause.setText("Pause")
+        else:
+            log.info("Pausing ...")
+            self.controller.pause()
+            self.button_pause.setText("Resume")
+
+    def action_cancel(self):
+        """
+        Do not process files of the running batch which are not started yet. Files being processed finish.
+        """
+        if self.controller is None:
+            return
+        log.info("Cancelling ...")
+        self.controller.cancel()
+        self.group_box_batch.setEnabled(False)
+
+    def action_prioritize(self):
+        """
+        Process files selected in the list before the others, if not started yet
+        """
+        if self.controller is None:
+            return
+        # Rows removed since the batch started shift the others : jobs are found by path
+        indexes = {path: index for index, path in enumerate(self.apply_paths)}
+        paths = [self.nif_files_list_widget.path(row) for row in self.nif_files_list_widget.selected_rows()]
+        log.info("Processing " + str(len(paths)) + " selected files first")
+        self.controller.prioritize([indexes[path] for path in paths if path in indexes])
+
+    def get_rules(self):
+        """
+        :return: RuleSet of the parameters and of htool.ini, None if htool.ini has invalid rules
+        """
+        try:
+            return RuleSet.from_values(self.spin_box_glossiness.value(), self.spin_box_specular_strength.value(),
+                                       load_rules(get_config()))
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Invalid rules", "Rules of htool.ini could not be read :\n\n" + str(e))
+            return None
+
+    def action_watch(self):
+        """
+        Start or stop processing files of the source folder as soon as they are created or modified
+        """
+        if self.watch_worker is not None:
+            log.info("Stopping watch ...")
+            self.watch_worker.stop.set()
+            self.button_watch.setEnabled(False)
+            return
+
+        if not self.source_folder:
+            QMessageBox.warning(self, "No source folder", "Scan a folder first, it will be the one watched.")
+            return
+
+        rules = self.get_rules()
+        if rules is None:
+            return
+
+        log.info("Watching directory : " + self.source_folder)
+        self.toggle(False)
+        self.group_box_watch.setEnabled(True)
+        self.button_watch.setText("Stop watching")
+        self.watch_worker = NifWatchWorker([self.source_folder], self.keywords, rules,
+                                           atomic=get_config().get("APPLY", "write", fallback="atomic") != "inplace",
+                                           cache=get_config().getboolean("SCAN", "cache", fallback=True),
+                                           debounce=get_config().getfloat("WATCH", "debounce", fallback=2.0),
+                                           interval=get_config().getfloat("WATCH", "interval", fallback=1.0))
+        self.watch_worker.signals.watched.connect(self.watched_file)
+        self.watch_worker.signals.finished.connect(self.finish_watch_action)
+        QThreadPool.globalInstance().start(self.watch_worker)
+
+    def watched_file(self, path, result):
+        # A file becoming relevant, or irrelevant, moves from one list to the other
+        if result == status.IGNORED:
+            self.nif_files_list_widget.remove_paths([path])
+            self.ignored_nif_files_list_widget.add_paths([path], status.IGNORED)
+        else:
+            self.ignored_nif_files_list_widget.remove_paths([path])
+            self.nif_files_list_widget.add_paths([path])
+            self.nif_files_list_widget.set_status(self.nif_files_list_widget.row(path), result)
+        self.lcd_nif_files_loaded.display(self.nif_files_list_widget.count())
+        self.lcd_nif_files_ignored.display(self.ignored_nif_files_list_widget.count())
+
+    def finish_watch_action(self):
+        self.watch_worker = None
+        self.button_watch.setText("Watch")
+        self.button_watch.setEnabled(True)
+        self.toggle(True)
+        log.info("Done !")
+
+    def closeEvent(self, event):
+        # The watching thread, or a paused batch, would keep the application running
+        if self.watch_worker is not None:
+            self.watch_worker.stop.set()
+        if self.controller is not None:
+            self.controller.cancel()
+        super().closeEvent(event)
+
+    def action_report(self):
+        """
+        Write the current values of the shader properties of relevant .nif files in a CSV file, without modifying them
+        """
+        if self.nif_files_list_widget.count() == 0:
+            QMessageBox.warning(self, "No .nif files loaded", "Don't forget to load .nif files !")
+            return
+
+        path = QFileDialog.getSaveFileName(self, "Save report", "htool_report.csv", "CSV (*.csv)")[0]
+        if not path:
+            return
+
+        log.info("Reporting shader values of " + str(self.nif_files_list_widget.count()) + " files ...")
+        self.toggle(False)
+        self.progress_bar.setMinimum(0)
+        self.progress_bar.setMaximum(100)
+        self.progress_bar.setValue(0)
+        # Reports never write anything : files only in an archive, which would have to be extracted, are left out
+        paths = [nif_path for nif_path in self.nif_files_list_widget.paths() if nif_path not in self.nif_archived]
+        worker = Worker(self.write_report, paths, path)
+        worker.signals.progress.connect(self.progress_bar.setValue)
+        worker.signals.result.connect(self.finish_report_action)
+        worker.signals.finished.connect(lambda: self.toggle(True))
+        QThreadPool.globalInstance().start(worker)
+
+    def write_report(self, paths, path, progress_callback):
+        self.report = ShaderReport()
+        for index, nif_path in enumerate(paths):
+            self.report.add(nif_path, read_nif_file(nif_path, self.keywords, self.nif_indexes.get(nif_path)))
+            if index % 100 == 0:
+                progress_callback.emit(100 * index // len(paths))
+        self.report.write_csv(path)
+        return len(self.report)
+
+    def finish_report_action(self, rows):
+        self.progress_bar.setValue(100)
+        log.info("Done !")
+        log.info(self.report.summary())
+        QMessageBox.information(self, "Results", "Done !\n\n" + self.report.summary().split("\n")[0] + ".\n\nSee the log file for statistics.")
+
+    def action_restore_backup(self):
+        """
+        Put back the files saved before the last apply (see backup in section APPLY of htool.ini)
+        """
+        batches = BackupStore().batches()
+        if not batches:
+            QMessageBox.warning(self, "No backup", "No backup found.\n\nSet backup = True in section [APPLY] of htool.ini to save files before applying.")
+            return
+
+        answer = QMessageBox.question(self, "Are you sure ?", "Files saved by backup " + batches[-1] + " will replace current ones.\n\nAre you sure you wish to continue ?")
+        if answer != QMessageBox.Yes:
+            return
+
+        log.info("Restoring backup " + batches[-1] + " ...")
+        self.toggle(False)
+        worker = Worker(self.restore_backup, batches[-1])
+        worker.signals.result.connect(self.finish_restore_action)
+        worker.signals.finished.connect(lambda: self.toggle(True))
+        QThreadPool.globalInstance().start(worker)
+
+    def restore_backup(self, batch, progress_callback):
+        restored, errors = BackupStore().restore(batch)
+        return errors
+
+    def finish_restore_action(self, errors):
+        log.info("Done !")
+        QMessageBox.information(self, "Results", "Done !\n\nBackup restored, with " + str(errors) + " error(s). See the log file for details.")
@@ -3,12 +3,18 @@
 
 import logging
 import sys
-import time
+import threading
 import traceback
 
 from PySide2.QtCore import QObject, Signal, QRunnable
 # From : https://www.learnpyqt.com/courses/concurrent-execution/multithreading-pyqt-applications-qthreadpool/
-from pyffi.formats.nif import NifFormat
+
+from src.nif.bsa import discard_overrides, extract_overrides
+from src.utils import status
+from src.utils.process_pool import process_files
+from src.utils.scan_cache import ScanCache
+from src.utils.scheduler import process_files_in_threads
+from src.utils.watcher import DEBOUNCE, POLL_INTERVAL, watch_folders
 
 log = logging.getLogger(__name__)
 
@@ -31,12 +37,15 @@ class WorkerSignals(QObject):
     progress
         `int` indicating % progress
 
+    watched
+        `str` path of a file created or modified in a watched folder, `int` status once processed
+
     '''
     finished = Signal()
     error = Signal(tuple)
-    result = Signal(int, bool)
+    result = Signal(int, int)
     progress = Signal(int)
-    start = Signal(int)
+    watched = Signal(str, int)
 
 
 class Worker(QRunnable):
@@ -80,92 +89,130 @@ class Worker(QRunnable):
             self.signals.finished.emit()  # Done
 
 
-class NifProcessWorker(QRunnable):
+class NifProcessPoolWorker(QRunnable):
     '''
-    Worker thread
-
-    Inherits from QRunnable to handler worker thread setup, signals and wrap-up.
-
-    :param callback: The function callback to run on this worker thread. Supplied args and
-                     kwargs will be passed through to the runner.
-    :type callback: function
-    :param args: Arguments to pass to the callback function
-    :param kwargs: Keywords to pass to the callback function
-
+    Worker thread dispatching files to a pool of processes
+
+    Pure-python parsing does not scale with threads (GIL), so each file is processed in a separate process.
+    The status of each file is written in a status table by the worker processing it, and finished is only emitted
+    once the batch is over : the GUI reads the table when it repaints, whatever the number of files.
+
+    :param jobs: list of (index, path) to process
+    :param keywords: keywords of the blocks to modify
+    :param rules: RuleSet to apply
+    :param table: StatusTable in which the status of each file is written, by index
+    :param workers: number of processes, 0 to use every core
+    :param indexes: dict path -> NifIndex built when scanning, for files which have one
+    :param atomic: replace files by new ones rather than modifying them in place
+    :param backup: BackupStore in which files are saved before being processed, or None
+    :param journal: Journal of the batch, to skip files already done by an interrupted run, or None
+    :param stats: profiling.BatchStats to which the timings of each file are added, or None
+    :param controller: scheduler.JobController to pause, cancel or prioritize jobs from the GUI, or None
+    :param archived: dict path -> ArchivedFile of files to extract from archives first, or None
     '''
 
-    def __init__(self, *args, **kwargs):
-        super(NifProcessWorker, self).__init__()
-
-        # Store constructor arguments (re-used for processing)
-        self.args = args
-        self.kwargs = kwargs
+    def __init__(self, jobs, keywords, rules, table, workers=0, indexes=None, atomic=True, backup=None, journal=None,
+                 stats=None, controller=None, archived=None):
+        super(NifProcessPoolWorker, self).__init__()
+
+        self.jobs = jobs
+        self.keywords = keywords
+        self.rules = rules
+        self.workers = workers
+        self.indexes = indexes
+        self.atomic = atomic
+        self.backup = backup
+        self.journal = journal
+        self.stats = stats
+        self.controller = controller
+        self.archived = archived
+        self.table = table
         self.signals = WorkerSignals()
 
-        # Add the callback to our kwargs
-        self.kwargs['progress_callback'] = self.signals.progress
+    process_files = staticmethod(process_files)
 
     def run(self):
-        '''
-        Initialise the runner function with passed args, kwargs.
-        '''
-        # Retrieve args/kwargs here; and fire processing using them
-        result = False
+        extracted = {}  # path -> status of files extracted from archives
         try:
-            self.signals.start.emit(self.kwargs['index'])
-            time.sleep(0.1)
-            result = self.process_nif_files(self.kwargs['path'], self.kwargs['keywords'], self.kwargs['glossiness'], self.kwargs['specular_strength'])
+            jobs = self.jobs
+            if self.journal is not None:
+                self.journal.open()
+                finished, jobs = self.journal.resume(jobs)
+                for index, result in finished:
+                    self.table.finish(index, result)
+            if self.archived:
+                extracted = dict.fromkeys(extract_overrides(self.archived, [path for index, path in jobs]),
+                                          status.NONE)
+            if self.backup is not None:
+                # Hard links are only valid backups if files are replaced rather than modified. Files extracted from
+                # archives did not exist : there is nothing to save.
+                self.backup.backup([path for index, path in jobs if path not in extracted], link=self.atomic)
+            paths = dict(jobs)
+            for index, result in self.process_files(jobs, self.keywords, self.rules, self.workers, self.indexes,
+                                                    self.atomic, self.journal, self.stats, self.controller,
+                                                    self.table):
+                if result is not None and paths[index] in extracted:
+                    extracted[paths[index]] = result
         except:
             traceback.print_exc()
             exctype, value = sys.exc_info()[:2]
             self.signals.error.emit((exctype, value, traceback.format_exc()))
-        else:
-            self.signals.result.emit(self.kwargs['index'], result)  # Return the result of the processing
         finally:
-            self.signals.finished.emit()  # Done
-            time.sleep(0.1)
+            if self.journal is not None:
+                self.journal.close()
+            discard_overrides([path for path, result in extracted.items() if result != status.DONE])
+            self.signals.finished.emit()
 
-    @staticmethod
-    def process_nif_files(path, keywords, glossiness, specular_strength):
-        success = False
-        data = NifFormat.Data()
 
+class NifThreadPoolWorker(NifProcessPoolWorker):
+    '''
+    Same as NifProcessPoolWorker, with a pool of threads instead of processes
+    '''
+
+    process_files = staticmethod(process_files_in_threads)
+
+
+class NifWatchWorker(QRunnable):
+    '''
+    Worker thread patching files of folders as soon as they are created or modified, until stop is set
+
+    :param folders: folders to watch
+    :param keywords: keywords of the blocks to modify
+    :param rules: RuleSet to apply
+    :param atomic: replace files by new ones rather than modifying them in place
+    :param cache: save inspection results in the scan cache
+    '''
+
+    def __init__(self, folders, keywords, rules, atomic=True, cache=True, debounce=DEBOUNCE, interval=POLL_INTERVAL):
+        super(NifWatchWorker, self).__init__()
+
+        self.folders = folders
+        self.keywords = keywords
+        self.rules = rules
+        self.atomic = atomic
+        self.cache = cache
+        self.debounce = debounce
+        self.interval = interval
+        self.stop = threading.Event()
+        self.signals = WorkerSignals()
+
+    def run(self):
+        # The scan cache must be used from a single thread : this one
+        cache = ScanCache() if self.cache else None
         try:
-            with open(path, 'rb') as stream:
-                data.read(stream)
-        except Exception:
-            log.exception("Error while reading stream from file : " + path)
-            return success
-
-        # First, let's get relevant NiTriShape block
-        block = None
-        index = 0
-        try:
-            root = data.roots[0]
-            while not block and index < len(keywords):
-                block = root.find(keywords[index])
-                index += 1
-
-            # Second, if found, change its parameters
-            if block is not None:
-                for subblock in block.tree():
-                    if subblock.__class__.__name__ == "BSLightingShaderProperty":
-                        old_gloss = subblock.glossiness
-                        subblock.glossiness = glossiness
-                        old_spec_strength = subblock.specular_strength
-                        subblock.specular_strength = specular_strength
-                        log.info("[" + path + "] ------ Glossiness " + str(old_gloss) + " -> " + str(
-                            glossiness) + " | Specular Strength " + str(old_spec_strength) + " -> " + str(
-                            specular_strength))
-                        success = True
-        except IndexError:
-            pass
-
-        if success:
-            try:
-                with open(path, 'wb') as stream:
-                    data.write(stream)
-            except Exception:
-                log.exception("Error while writing to file : " + path)
-
-        return success
+            for path, entry, result in watch_folders(self.folders, self.keywords, self.rules, self.stop, self.atomic,
+                                                     cache, self.debounce, self.interval):
+                if result is not None:
+                    self.signals.watched.emit(path, result)
+                elif entry.result() is False:
+                    self.signals.watched.emit(path, status.IGNORED)
+                if cache is not None:
+                    cache.commit()
+        except:
+            traceback.print_exc()
+            exctype, value = sys.exc_info()[:2]
+            self.signals.error.emit((exctype, value, traceback.format_exc()))
+        finally:
+            if cache is not None:
+                cache.close()
+            self.signals.finished.emit()
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import shutil
+import time
+
+from src.utils.config import DEFAULT_CONFIG_FILE
+from src.utils.files import atomic_copy
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BACKUP_FOLDER = os.path.join(os.path.dirname(DEFAULT_CONFIG_FILE), "htool_backup")
+MANIFEST_FILE = "manifest.json"
+
+
+class BackupStore:
+    """
+    Original files of each batch, to undo it. Each batch is a sub folder named after its start time, with a manifest
+    mapping stored files to original paths.
+    """
+
+    def __init__(self, folder=DEFAULT_BACKUP_FOLDER):
+        self.folder = folder
+
+    def backup(self, paths, link=True):
+        """
+        Save files before they are modified
+        :param link: hard link files instead of copying them, when possible. Only valid if files are then replaced
+                     by new ones (atomic writes) : files modified in place would modify their backup as well.
+        :return: name of the batch
+        """
+        batch = time.strftime("%Y%m%d-%H%M%S")
+        suffix = 1
+        while os.path.exists(os.path.join(self.folder, batch)):
+            suffix += 1
+            batch = time.strftime("%Y%m%d-%H%M%S") + "-" + str(suffix)
+        batch_folder = os.path.join(self.folder, batch)
+        os.makedirs(batch_folder)
+
+        files = {}
+        linked = 0
+        for index, path in enumerate(paths):
+            name = str(index) + ".nif"
+            try:
+                if link:
+                    try:
+                        os.link(path, os.path.join(batch_folder, name))
+                        linked += 1
+                    except OSError:  # other drive, file system without hard links, ...
+                        shutil.copy2(path, os.path.join(batch_folder, name))
+                else:
+                    shutil.copy2(path, os.path.join(batch_folder, name))
+                files[name] = os.path.abspath(path)
+            except OSError:
+                log.exception("[" + path + "] - Error while saving backup")
+
+        with open(os.path.join(batch_folder, MANIFEST_FILE), "w") as stream:
+            json.dump({"files": files}, stream, indent=1)
+        log.info("Backup " + batch + " : " + str(len(files)) + " files saved (" + str(linked) + " hard links)")
+        return batch
+
+    def batches(self):
+        """
+        :return: names of saved batches, from oldest to newest
+        """
+        if not os.path.isdir(self.folder):
+            return []
+        return sorted(name for name in os.listdir(self.folder)
+                      if os.path.isfile(os.path.join(self.folder, name, MANIFEST_FILE)))
+
+    def restore(self, batch=None):
+        """
+        Put back original files of a batch
+        :param batch: name of the batch, latest one if None
+        :return: tuple (number of restored files, number of errors)
+        """
+        if batch is None:
+            batches = self.batches()
+            if not batches:
+                raise FileNotFoundError("No backup in " + self.folder)
+            batch = batches[-1]
+
+        batch_folder = os.path.join(self.folder, batch)
+        with open(os.path.join(batch_folder, MANIFEST_FILE)) as stream:
+            files = json.load(stream)["files"]
+
+        restored = 0
+        errors = 0
+        for name, path in sorted(files.items()):
+            try:
+                atomic_copy(os.path.join(batch_folder, name), path)
+                restored += 1
+            except OSError:
+                log.exception("[" + path + "] - Error while restoring backup")
+                errors += 1
+        log.info("Backup " + batch + " : " + str(restored) + " files restored, " + str(errors) + " errors")
+        return restored, errors
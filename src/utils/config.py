@@ -15,14 +15,39 @@ def create_config():
     config = configparser.ConfigParser()
 
     config['DEFAULT'] = {
-        "sourceFolder": "",
-        "softLimit": "100"
+        "sourceFolder": ""
     }
 
     config["NIF"] = {
         "keywords" : "UUNP, FemaleHead, Hands, Feet, CL0, CL1",
         "glossiness": "450",
-        "specularStrength": "3.5"
+        "specularStrength": "3.5",
+        "preset": ""
+    }
+
+    # Other changes to shader properties, e.g. "alpha = clamp 0 1", or in RULES:<keyword> for a single keyword
+    config["RULES"] = {}
+
+    # archives : also patch meshes stored in .bsa archives, written as loose files overriding them
+    config["SCAN"] = {
+        "cache": "True",
+        "workers": "8",
+        "archives": "False"
+    }
+
+    config["APPLY"] = {
+        "backend": "process",
+        "workers": "0",
+        "write": "atomic",
+        "backup": "False",
+        "journal": "True",
+        "profile": "False"
+    }
+
+    # Watch mode : changed files are patched once they have not changed for debounce seconds
+    config["WATCH"] = {
+        "debounce": "2.0",
+        "interval": "1.0"
     }
 
     config["LOG"] = {
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+
+
+class AtomicFile:
+    """
+    Temporary file, in the same folder as the file it replaces once complete. A crash or a kill before commit leaves
+    the original file untouched, never a truncated one. Not committed temporary files are removed when leaving the
+    with block.
+
+    with AtomicFile(path) as file:
+        with open(file.temp_path, "wb") as stream:
+            stream.write(...)
+        file.commit()
+    """
+
+    def __init__(self, path, copy=False):
+        """
+        :param copy: start from a copy of the file, to modify it in place
+        """
+        self.path = path
+        directory, name = os.path.split(path)
+        fd, self.temp_path = tempfile.mkstemp(prefix="." + name + ".", suffix=".tmp", dir=directory or ".")
+        os.close(fd)
+        self.committed = False
+        try:
+            if copy:
+                shutil.copyfile(path, self.temp_path)
+        except BaseException:
+            self._remove()
+            raise
+
+    def commit(self):
+        """ Replace the original file by the temporary one """
+        with open(self.temp_path, "rb+") as stream:
+            os.fsync(stream.fileno())
+        if os.path.exists(self.path):
+            shutil.copymode(self.path, self.temp_path)
+        os.replace(self.temp_path, self.path)
+        self.committed = True
+
+    def _remove(self):
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.committed:
+            self._remove()
+        return False
+
+
+def atomic_copy(source, destination):
+    """ Copy a file, replacing destination only once the copy is complete """
+    with AtomicFile(destination) as file:
+        shutil.copyfile(source, file.temp_path)
+        file.commit()
+
+
+def file_digest(path):
+    """
+    :return: BLAKE2b digest of the content of a file, as an hexadecimal string
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as stream:
+        try:
+            with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                digest.update(buffer)
+        except ValueError:  # empty file
+            pass
+    return digest.hexdigest()
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+
+from src.utils import status
+from src.utils.config import DEFAULT_CONFIG_FILE
+from src.utils.files import AtomicFile, file_digest
+
+log = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL_FILE = os.path.join(os.path.dirname(DEFAULT_CONFIG_FILE), "htool_journal.jsonl")
+
+QUEUED = "queued"
+STARTED = "started"
+STATE_NAMES = {status.DONE: "done", status.UNCHANGED: "unchanged", status.FAILED: "failed"}
+FINISHED_STATES = {"done": status.DONE, "unchanged": status.UNCHANGED}
+
+
+class Journal:
+    """
+    Progress of an apply batch, written as it goes, so that a batch interrupted by a crash can be resumed : files
+    already done are skipped, as long as their content has not changed since.
+    One JSON object per line, the first one describing the batch : the journal of a batch with other parameters is
+    discarded. The last line of a file gives its state.
+    When closed, the journal is removed if every file of the batch has been processed, otherwise it is rewritten with
+    only the last state of each file : it does not grow with each batch.
+    Must be used from a single thread.
+
+    with Journal(keywords, rules) as journal:
+        finished, jobs = journal.resume(jobs)
+        ...
+    """
+
+    def __init__(self, keywords, rules, path=DEFAULT_JOURNAL_FILE):
+        """
+        :param rules: RuleSet of the batch
+        """
+        self.path = path
+        self.batch = {"keywords": [keyword.decode("ascii") for keyword in keywords], "rules": rules.to_list()}
+        self.entries = {}
+        self.stream = None
+
+    def open(self):
+        """
+        Load the journal of the same batch if any, and start writing
+        """
+        self.entries = {}
+        resumed = False
+        try:
+            with open(self.path) as stream:
+                resumed = json.loads(stream.readline() or "{}").get("batch") == self.batch
+                for line in stream if resumed else ():
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # last line, cut by a crash
+                        continue
+                    self.entries[entry["path"]] = entry
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            log.exception("Unable to read journal " + self.path + ", starting a new one")
+            resumed = False
+            self.entries = {}
+
+        if resumed:
+            self.stream = open(self.path, "a")
+        else:
+            self.stream = open(self.path, "w")
+            self._write({"batch": self.batch})
+
+    def close(self):
+        if self.stream is None:
+            return
+        self.stream.close()
+        self.stream = None
+        try:
+            if any(entry["state"] in (QUEUED, STARTED) for entry in self.entries.values()):
+                self._compact()
+            else:
+                os.remove(self.path)
+        except OSError:
+            log.exception("Unable to clean journal " + self.path)
+
+    def _compact(self):
+        with AtomicFile(self.path) as file:
+            with open(file.temp_path, "w") as stream:
+                stream.write(json.dumps({"batch": self.batch}) + "\n")
+                for entry in self.entries.values():
+                    stream.write(json.dumps(entry) + "\n")
+            file.commit()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def resume(self, jobs):
+        """
+        :param jobs: list of (index, path)
+        :return: tuple (list of (index, status) of files already finished, list of (index, path) left to process)
+        """
+        finished = []
+        remaining = []
+        for index, path in jobs:
+            result = self.finished(path)
+            if result is None:
+                remaining.append((index, path))
+            else:
+                finished.append((index, result))
+        if finished:
+            log.info("Resuming batch : " + str(len(finished)) + " files already done are skipped")
+        return finished, remaining
+
+    def finished(self, path):
+        """
+        :return: status of the file if it has already been done by this batch and has not changed since, else None
+        """
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None or entry["state"] not in FINISHED_STATES or "hash" not in entry:
+            return None
+        try:
+            stat = os.stat(path)
+            if stat.st_size != entry["size"]:
+                return None
+            # Same size and modification time : no need to read it again
+            if stat.st_mtime_ns != entry["mtime_ns"] and file_digest(path) != entry["hash"]:
+                return None
+        except OSError:
+            return None
+        return FINISHED_STATES[entry["state"]]
+
+    def queue(self, paths):
+        for path in paths:
+            self._write({"path": os.path.abspath(path), "state": QUEUED})
+
+    def start(self, path):
+        self._write({"path": os.path.abspath(path), "state": STARTED})
+
+    def record(self, path, result, digest=None):
+        """
+        :param result: status of the processed file
+        :param digest: file_digest of the file once processed, None if it failed
+        """
+        entry = {"path": os.path.abspath(path), "state": STATE_NAMES[result]}
+        if digest is not None:
+            try:
+                stat = os.stat(path)
+                entry.update(hash=digest, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            except OSError:
+                entry["state"] = STATE_NAMES[status.FAILED]
+        self._write(entry)
+
+    def _write(self, entry):
+        if "path" in entry:
+            self.entries[entry["path"]] = entry
+        self.stream.write(json.dumps(entry) + "\n")
+        self.stream.flush()
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import functools
+import logging
+import logging.handlers
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src.utils import status
+from src.utils.scheduler import IN_FLIGHT_PER_WORKER, find_duplicates, get_worker_count, run_job, run_jobs
+
+log = logging.getLogger(__name__)
+
+# Set in each worker process by init_process
+_events = None
+_table = None
+
+
+def init_process(events, logs, level, table=None):
+    """
+    Initializer of each worker process : keep the event queue and the status table, and forward log records to the
+    main process, so that only one process writes in the log file.
+    """
+    global _events, _table
+    _events = events
+    _table = table
+    # Ctrl+C is handled by the main process (see cli.apply) : files being processed must finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(logs))
+    root.setLevel(level)
+
+
+def process_job(index, path, keywords, rules, nif_index=None, atomic=True, digest=False, submitted=None,
+                profile_folder=None):
+    """
+    Process one file in a worker process. Events are put in the event queue, see scheduler.run_job
+    """
+    run_job(_events, index, path, keywords, rules, nif_index, atomic, digest, submitted, profile_folder, _table)
+
+
+def _job_done(events, table, index, path, future):
+    # Job could not run till the end (worker process killed, ...) : no result has been sent by the process
+    if not future.cancelled():
+        if future.exception() is None:
+            return
+        log.error("Error while processing file : " + path + " (" + repr(future.exception()) + ")")
+    if table is not None:
+        table.finish(index, status.FAILED)
+    events.put((index, status.FAILED, None, None))
+
+
+def _submit(executor, events, keywords, rules, indexes, atomic, digest, profile_folder, table, index, path):
+    future = executor.submit(process_job, index, path, keywords, rules, indexes.get(path), atomic, digest, time.time(),
+                             profile_folder)
+    future.add_done_callback(functools.partial(_job_done, events, table, index, path))
+
+
+def process_files(jobs, keywords, rules, workers=0, indexes=None, atomic=True, journal=None, stats=None,
+                  controller=None, table=None):
+    """
+    Process files in a pool of processes, to get around the GIL
+    :param jobs: list of (index, path) to process
+    :param rules: RuleSet to apply
+    :param workers: number of processes, 0 to use every core
+    :param indexes: dict path -> NifIndex built when scanning, for files which have one
+    :param atomic: replace files by new ones rather than modifying them in place, see process_nif_file
+    :param journal: opened Journal in which the progress of each file is written, or None
+    :param stats: profiling.BatchStats to which the timings of each file are added, or None
+    :param controller: scheduler.JobController to pause, cancel or prioritize jobs from another thread, or None
+    :param table: StatusTable in which the status of each file is written as well, by the worker processes, or None
+    :return: generator of events, (index, None) when a file is started and (index, status) when it is done
+    """
+    events = multiprocessing.Queue()
+    logs = multiprocessing.Queue()
+    root = logging.getLogger()
+    listener = logging.handlers.QueueListener(logs, *root.handlers, respect_handler_level=True)
+    listener.start()
+    workers = get_worker_count(workers)
+    log.info("Starting " + str(workers) + " worker processes")
+
+    jobs, duplicates = find_duplicates(jobs, indexes)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_process,
+                                 initargs=(events, logs, root.level, table)) as executor:
+            submit = functools.partial(_submit, executor, events, keywords, rules, indexes or {}, atomic,
+                                       journal is not None, stats and stats.profile_folder, table)
+            yield from run_jobs(submit, jobs, events, IN_FLIGHT_PER_WORKER * workers, journal, duplicates,
+                                atomic, stats, controller, table)
+    finally:
+        listener.stop()
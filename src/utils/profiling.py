@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import contextlib
+import cProfile
+import glob
+import io
+import os
+import pstats
+import threading
+import time
+
+from src.utils.config import DEFAULT_CONFIG_FILE
+
+DEFAULT_PROFILE_FOLDER = os.path.join(os.path.dirname(DEFAULT_CONFIG_FILE), "htool_profile")
+# Stages of the processing of a file, timed by stage()
+STAGES = ("open", "parse", "find", "modify", "serialize", "write", "hash")
+
+# Timings of the file being processed by the current thread, set by collect()
+_local = threading.local()
+
+
+class Timings:
+    """ Time spent in each stage of the processing of one file, and bytes read and written """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.wait = 0.0  # Between the submission of the job and its start
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+
+@contextlib.contextmanager
+def collect(submitted=None):
+    """
+    Record the stages of the processing of a file, in this thread
+    :param submitted: time.time() when the job was submitted, to measure its wait
+    :return: context manager giving the Timings
+    """
+    timings = Timings()
+    if submitted is not None:
+        timings.wait = max(0.0, time.time() - submitted)
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = None
+
+
+@contextlib.contextmanager
+def stage(name):
+    """ Add the time spent in the with block to a stage of the file being processed, if any """
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.seconds[name] += time.perf_counter() - start
+
+
+def count(read=0, written=0):
+    """ Add bytes read or written to the file being processed, if any """
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings.bytes_read += read
+        timings.bytes_written += written
+
+
+@contextlib.contextmanager
+def profile(folder):
+    """
+    Run the with block under cProfile, if folder is set. Statistics are accumulated for each thread of each process,
+    and saved in folder, to be merged by merge_profiles.
+    """
+    if folder is None:
+        yield
+        return
+    profiler = getattr(_local, "profiler", None)
+    if profiler is None:
+        profiler = _local.profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(folder, str(os.getpid()) + "-" + str(threading.get_ident()) + ".prof"))
+
+
+def merge_profiles(folder, path, lines=25):
+    """
+    Merge statistics saved by profile in a single file, which can be opened by pstats, snakeviz, ...
+    :return: text of the functions with the highest cumulative time
+    """
+    files = glob.glob(os.path.join(folder, "*.prof"))
+    if not files:
+        return ""
+    stats = pstats.Stats(*files, stream=io.StringIO())
+    stats.dump_stats(path)
+    stats.sort_stats("cumulative").print_stats(lines)
+    for file in files:
+        os.remove(file)
+    try:
+        os.rmdir(folder)
+    except OSError:
+        pass
+    return stats.stream.getvalue()
+
+
+class BatchStats:
+    """
+    Timings of every file of a batch. Filled by scheduler.run_jobs, can be read from another thread.
+    """
+
+    def __init__(self, profile_folder=None):
+        """
+        :param profile_folder: folder in which jobs save their cProfile statistics, None to disable profiling
+        """
+        self.profile_folder = profile_folder
+        if profile_folder is not None:
+            os.makedirs(profile_folder, exist_ok=True)
+        self.start = time.perf_counter()
+        self.end = self.start
+        self.total = 0  # files of the batch, 0 if unknown
+        self.files = 0
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.wait = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def begin(self, total):
+        """
+        Start measuring, once files are about to be processed
+        :param total: number of files which will be added
+        """
+        self.start = self.end = time.perf_counter()
+        self.total = total
+
+    def rate(self):
+        """
+        :return: files per second so far, 0 if none is done
+        """
+        return self.files / max(self.end - self.start, 1e-9)
+
+    def remaining(self):
+        """
+        :return: estimated seconds left from the throughput so far, None if unknown
+        """
+        if not self.files or not self.total:
+            return None
+        return max(self.total - self.files, 0) / self.rate()
+
+    def add(self, timings):
+        """
+        :param timings: Timings of the file, None if it has not been processed by a job (duplicate, ...)
+        """
+        self.files += 1
+        if timings is not None:
+            for name, seconds in timings.seconds.items():
+                self.seconds[name] += seconds
+            self.wait += timings.wait
+            self.bytes_read += timings.bytes_read
+            self.bytes_written += timings.bytes_written
+        self.end = time.perf_counter()
+
+    def summary(self):
+        """
+        :return: text of a few lines, for the log and the GUI
+        """
+        busy = sum(self.seconds.values()) or 1e-9
+        files = str(self.files)
+        if self.total and self.files < self.total:
+            files += " / " + str(self.total)
+            if self.remaining() is not None:
+                files += ", about " + format_duration(self.remaining()) + " left"
+        return ("{} files in {} ({:.1f} files/s)\n"
+                "{:.1f} MB read, {:.1f} MB written\n"
+                "Average wait in queue : {:.1f} ms\n".format(
+                    files, format_duration(self.end - self.start), self.rate(), self.bytes_read / 1e6,
+                    self.bytes_written / 1e6, 1000 * self.wait / max(self.files, 1)) +
+                " | ".join("{} {:.0f}%".format(name, 100 * seconds / busy) for name, seconds in self.seconds.items()))
+
+    def to_dict(self):
+        return {"files": self.files, "seconds": self.end - self.start, "stages": dict(self.seconds),
+                "wait": self.wait, "bytes_read": self.bytes_read, "bytes_written": self.bytes_written}
+
+
+def format_duration(seconds):
+    """
+    :return: e.g. "2.35 s", "3 min 05 s" or "1 h 02 min"
+    """
+    if seconds < 60:
+        return format(seconds, ".2f") + " s"
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes < 60:
+        return str(minutes) + " min " + format(seconds, "02") + " s"
+    hours, minutes = divmod(minutes, 60)
+    return str(hours) + " h " + format(minutes, "02") + " min"
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import sqlite3
+
+from src.nif.patcher import NifIndex
+from src.utils.config import DEFAULT_CONFIG_FILE
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.dirname(DEFAULT_CONFIG_FILE), "htool_scan.db")
+
+
+class ScanEntry:
+    """ Cached result of the inspection of a file """
+
+    def __init__(self, root_type, strings, keywords, matched, nif_index=None):
+        self.root_type = root_type  # None if the file could not be inspected
+        self.strings = strings
+        self.keywords = keywords
+        self.matched = matched
+        self.nif_index = nif_index  # NifIndex of relevant files, if they can be patched in place
+
+    def result(self):
+        """
+        :return: True if the file is relevant, i.e. its root is a NiNode and one of its strings is a keyword, False if
+        its root is a NiNode but no keyword has been found, None if it can't be processed
+        """
+        if self.root_type != "NiNode".encode('ascii'):
+            return None
+        return self.matched
+
+
+class ScanCache:
+    """
+    On-disk cache of inspection results, so that unchanged files are not opened again when rescanning a folder.
+    An entry is only valid for the same (path, size, mtime_ns) : stale entries are replaced or evicted.
+    Must be used from a single thread.
+    """
+
+    COLUMNS = ["path", "size", "mtime_ns", "root_type", "strings", "keywords", "matched", "nif_index"]
+    VERSION = 1  # Of the content of the columns, e.g. NifIndex.to_bytes
+
+    def __init__(self, path=DEFAULT_CACHE_FILE):
+        self.connection = sqlite3.connect(path)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(files)")]
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if columns and (columns != self.COLUMNS or version != self.VERSION):
+            # Cache written by another version of the tool : it is only a cache, start again
+            log.info("Resetting scan cache")
+            self.connection.execute("DROP TABLE files")
+        self.connection.execute("PRAGMA user_version = " + str(self.VERSION))
+        self.connection.execute("CREATE TABLE IF NOT EXISTS files ("
+                                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                                "root_type BLOB, strings BLOB, keywords BLOB, matched INTEGER, nif_index BLOB)")
+        self.entries = {}
+
+    def load(self, folder):
+        """
+        Load entries of every file in folder, so that lookups do not need a query each
+        """
+        folder = folder.rstrip("/\\")
+        cursor = self.connection.execute("SELECT path, size, mtime_ns, root_type, strings, keywords, matched, "
+                                         "nif_index FROM files WHERE substr(path, 1, ?) = ? AND substr(path, ?, 1) IN ('/', '\\')",
+                                         (len(folder), folder, len(folder) + 1))
+        for path, size, mtime_ns, root_type, strings, keywords, matched, nif_index in cursor:
+            if nif_index is not None:
+                nif_index = NifIndex.from_bytes(nif_index, size, mtime_ns)
+            self.entries[path] = (size, mtime_ns, ScanEntry(root_type, _split(strings), keywords, bool(matched),
+                                                            nif_index))
+
+    def get(self, path, size, mtime_ns):
+        """
+        :return: ScanEntry, or None if the file is not in cache or has changed
+        """
+        if path not in self.entries:
+            return None
+        cached_size, cached_mtime_ns, entry = self.entries[path]
+        if cached_size != size or cached_mtime_ns != mtime_ns:
+            return None
+        return entry
+
+    def put(self, path, size, mtime_ns, entry):
+        self.entries[path] = (size, mtime_ns, entry)
+        nif_index = None if entry.nif_index is None else entry.nif_index.to_bytes()
+        self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                (path, size, mtime_ns, entry.root_type, b"\0".join(entry.strings), entry.keywords,
+                                 int(entry.matched), nif_index))
+
+    def evict(self, folder, paths):
+        """
+        Remove entries of files in folder which are not in paths anymore (deleted, renamed, ...)
+        """
+        folder = folder.rstrip("/\\")
+        stale = [(path,) for path in self.entries
+                 if path.startswith(folder) and path[len(folder):len(folder) + 1] in ("/", "\\") and path not in paths]
+        for path, in stale:
+            del self.entries[path]
+        self.connection.executemany("DELETE FROM files WHERE path = ?", stale)
+        if stale:
+            log.info("Evicted " + str(len(stale)) + " stale entries from scan cache")
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+def _split(strings):
+    return strings.split(b"\0") if strings else []
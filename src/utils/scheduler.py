@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import collections
+import functools
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.nif.processing import process_nif_file
+from src.utils import profiling, status
+from src.utils.files import atomic_copy, file_digest
+
+log = logging.getLogger(__name__)
+
+IN_FLIGHT_PER_WORKER = 2  # jobs submitted ahead for each worker, so that none of them waits for the next one
+
+
+def get_worker_count(workers):
+    """
+    :param workers: configured number of workers, 0 or less to use every core
+    :return: number of workers to start
+    """
+    if workers > 0:
+        return workers
+    return os.cpu_count() or 1
+
+
+def largest_first(jobs):
+    """
+    Order jobs by decreasing file size, so that the biggest files are not left alone at the end of a batch
+    :param jobs: list of (index, path)
+    :return: sorted list of (index, path)
+    """
+    sized_jobs = []
+    for job in jobs:
+        try:
+            size = os.path.getsize(job[1])
+        except OSError:
+            size = 0  # reported as an error when processed
+        sized_jobs.append((size, job))
+    sized_jobs.sort(key=lambda sized_job: sized_job[0], reverse=True)
+    return [job for size, job in sized_jobs]
+
+
+def find_duplicates(jobs, indexes=None):
+    """
+    Group files with the same content, so that only one of them is parsed and patched. Files indexed when scanning
+    are left out : patching them is as fast as copying. Only files of the same size are hashed.
+    :param jobs: list of (index, path)
+    :param indexes: dict path -> NifIndex built when scanning
+    :return: tuple (list of (index, path) to process, dict index of a processed file -> list of (index, path) of
+    files with the same content)
+    """
+    indexes = indexes or {}
+    by_size = collections.defaultdict(list)
+    for index, path in jobs:
+        if path in indexes:
+            continue
+        try:
+            by_size[os.path.getsize(path)].append((index, path))
+        except OSError:
+            pass  # reported as an error when processed
+
+    by_digest = collections.defaultdict(list)
+    for size, same_size_jobs in by_size.items():
+        if len(same_size_jobs) < 2:
+            continue
+        for index, path in same_size_jobs:
+            try:
+                by_digest[(size, file_digest(path))].append((index, path))
+            except OSError:
+                pass
+
+    duplicates = {}
+    duplicate_indexes = set()
+    for same_jobs in by_digest.values():
+        if len(same_jobs) > 1:
+            duplicates[same_jobs[0][0]] = same_jobs[1:]
+            duplicate_indexes.update(index for index, path in same_jobs[1:])
+    if duplicate_indexes:
+        log.info(str(len(duplicate_indexes)) + " files are copies of other ones, and will be written without being "
+                                               "parsed")
+    return [job for job in jobs if job[0] not in duplicate_indexes], duplicates
+
+
+class JobController:
+    """
+    Control of a running batch from another thread (e.g. the GUI) : pause, resume, cancel, or process some files
+    first. Only jobs not submitted yet are affected, files being processed always finish.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = threading.Event()
+        self.running.set()
+        self.cancelled = False
+        self.priority = []  # indexes of files to process first, in order
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def paused(self):
+        return not self.running.is_set()
+
+    def cancel(self):
+        """ Files not submitted yet will not be processed, even if paused """
+        self.cancelled = True
+        self.running.set()
+
+    def prioritize(self, indexes):
+        """ Process files of these indexes before the others, if not submitted yet """
+        with self.lock:
+            self.priority.extend(indexes)
+
+    def take_priority(self):
+        """
+        :return: indexes to process first since the last call
+        """
+        with self.lock:
+            priority = self.priority
+            self.priority = []
+        return priority
+
+
+def copy_result(source, destination, atomic=True):
+    """
+    Write the content of a processed file to a file which had the same content
+    :param atomic: replace destination by a copy, rather than overwriting its content
+    """
+    if atomic:
+        atomic_copy(source, destination)
+    else:
+        with open(source, "rb") as source_stream, open(destination, "r+b") as destination_stream:
+            shutil.copyfileobj(source_stream, destination_stream)
+            destination_stream.truncate()
+
+
+def run_jobs(submit, jobs, events, in_flight, journal=None, duplicates=None, atomic=True, stats=None,
+             controller=None, table=None):
+    """
+    Submit jobs largest first, keeping at most in_flight of them submitted but not done, and stream their events.
+    :param submit: function(index, path) submitting one job, which must put (index, None, None, None) in events when
+                   started and (index, status, digest, timings) when done, even if it fails (see run_job)
+    :param jobs: list of (index, path)
+    :param events: queue of events
+    :param in_flight: maximum number of jobs submitted but not done
+    :param journal: opened Journal in which the progress of each file is written, or None
+    :param duplicates: dict index of a job -> list of (index, path) of files with the same content, not in jobs.
+                       They get the content of the processed file. If it failed, one of them is processed in its
+                       place, and if that one fails too, they all fail without being processed.
+    :param atomic: replace duplicates by copies, see copy_result
+    :param stats: profiling.BatchStats to which the timings of each file are added, or None
+    :param controller: JobController to pause, cancel or prioritize jobs from another thread, or None
+    :param table: StatusTable in which the statuses of duplicates and cancelled files are written, or None. Submitted
+                  jobs write their own.
+    :return: generator of events, (index, None) when a file is started and (index, status) when it is done.
+    Files cancelled before being processed end with status.NONE.
+    """
+    duplicates = duplicates or {}
+    controller = controller or JobController()
+    paths = dict(jobs)
+    representatives = {}
+    for index, same_jobs in duplicates.items():
+        paths.update(same_jobs)
+        representatives.update((same_index, index) for same_index, same_path in same_jobs)
+    if journal is not None:
+        journal.queue(paths.values())
+    if stats is not None:
+        stats.begin(len(paths))
+    # A duplicate of each failed file is processed on its own, before the next jobs
+    retries = collections.deque()
+    retried = set()
+    queued = collections.OrderedDict(largest_first(jobs))
+    pending = 0
+    while True:
+        while pending < in_flight and _submit_next(submit, retries, queued, controller, representatives):
+            pending += 1
+        if not pending:
+            if controller.cancelled or not (queued or retries):
+                break
+            # Paused : wait for resume or cancel, nothing is being processed
+            controller.running.wait()
+            continue
+
+        index, result, digest, timings = events.get()
+        done = [(index, result, digest)]
+        if result is not None:
+            if stats is not None:
+                stats.add(timings)
+            pending -= 1
+            same_jobs = duplicates.pop(index, [])
+            if result == status.FAILED and same_jobs and index not in retried:
+                # In case only this file could not be read or written : the other duplicates wait for the result of
+                # the retried one
+                retry_index = same_jobs[0][0]
+                retries.append(same_jobs[0])
+                retried.add(retry_index)
+                if len(same_jobs) > 1:
+                    duplicates[retry_index] = same_jobs[1:]
+                    representatives.update((same_index, retry_index) for same_index, same_path in same_jobs[1:])
+                same_jobs = []
+            for same_index, same_path in same_jobs:
+                done.append((same_index, None, None))
+                done.append((same_index, _copy_duplicate(paths[index], same_path, result, atomic), digest))
+                if stats is not None:
+                    stats.add(None)
+                if table is not None:
+                    table.finish(same_index, done[-1][1])
+
+        for index, result, digest in done:
+            if journal is not None:
+                if result is None:
+                    journal.start(paths[index])
+                else:
+                    journal.record(paths[index], result, digest)
+            yield index, result
+
+    # Cancelled : queued files and their duplicates are left as they are, and stay queued in the journal
+    cancelled = list(queued) + [index for index, path in retries]
+    if cancelled:
+        log.info(str(len(cancelled)) + " files cancelled")
+    for index in cancelled:
+        for cancelled_index in [index] + [same_index for same_index, same_path in duplicates.pop(index, [])]:
+            if table is not None:
+                table.finish(cancelled_index, status.NONE)
+            yield cancelled_index, status.NONE
+
+
+def _submit_next(submit, retries, queued, controller, representatives):
+    """
+    :param queued: OrderedDict index -> path of jobs not submitted yet
+    :param representatives: dict index of a duplicate -> index of the job processed for it
+    :return: True if a job has been submitted
+    """
+    if controller.cancelled or controller.paused():
+        return False
+    if retries:
+        submit(*retries.popleft())
+        return True
+    # Moved to the front in reverse order, so that they are processed in the given order
+    for index in reversed(controller.take_priority()):
+        index = representatives.get(index, index)
+        if index in queued:
+            queued.move_to_end(index, last=False)
+    if queued:
+        submit(*queued.popitem(last=False))
+        return True
+    return False
+
+
+def _copy_duplicate(source, destination, result, atomic):
+    """
+    :return: status of destination, given the status of source
+    """
+    if result == status.UNCHANGED:
+        log.info("[" + destination + "] ------ Unchanged : same content as " + source)
+        return result
+    if result == status.FAILED:
+        log.error("[" + destination + "] ------ Not processed : same content as " + source + ", which failed as well as "
+                  "another copy")
+        return result
+    try:
+        copy_result(source, destination, atomic)
+    except OSError:
+        log.exception("Error while writing to file : " + destination)
+        return status.FAILED
+    log.info("[" + destination + "] ------ Same content as " + source)
+    return result
+
+
+def run_job(events, index, path, keywords, rules, nif_index=None, atomic=True, digest=False, submitted=None,
+            profile_folder=None, table=None):
+    """
+    Process one file, putting (index, None, None, None) in events when started and (index, status, digest, timings)
+    when done
+    :param digest: compute the file_digest of the file once processed, for the journal
+    :param submitted: time.time() when the job was submitted, to measure how long it waited
+    :param profile_folder: folder in which cProfile statistics are saved, None to not profile (see profiling.profile)
+    :param table: StatusTable in which the status of the file is written as well, or None
+    """
+    if table is not None:
+        table.start(index)
+    events.put((index, None, None, None))
+    start = time.perf_counter()
+    result = status.FAILED
+    content_digest = None
+    with profiling.collect(submitted) as timings:
+        try:
+            with profiling.profile(profile_folder):
+                result = process_nif_file(path, keywords, rules, nif_index, atomic)
+                if digest and result != status.FAILED:
+                    with profiling.stage("hash"):
+                        content_digest = file_digest(path)
+        except Exception:
+            log.exception("Error while processing file : " + path)
+        finally:
+            # Before the event : once the batch is over, the table is complete
+            if table is not None:
+                table.finish(index, result, time.perf_counter() - start, timings.bytes_written)
+            events.put((index, result, content_digest, timings))
+
+
+def process_files_in_threads(jobs, keywords, rules, workers=0, indexes=None, atomic=True, journal=None, stats=None,
+                             controller=None, table=None):
+    """
+    Same as process_pool.process_files, with a pool of threads : no process to start, but files parsed with pyffi
+    do not run in parallel (GIL)
+    :param jobs: list of (index, path) to process
+    :param rules: RuleSet to apply
+    :param workers: number of threads, 0 to use every core
+    :param indexes: dict path -> NifIndex built when scanning, for files which have one
+    :param atomic: replace files by new ones rather than modifying them in place, see process_nif_file
+    :param journal: opened Journal in which the progress of each file is written, or None
+    :param stats: profiling.BatchStats to which the timings of each file are added, or None
+    :param controller: JobController to pause, cancel or prioritize jobs from another thread, or None
+    :param table: StatusTable in which the status of each file is written as well, or None
+    :return: generator of events, (index, None) when a file is started and (index, status) when it is done
+    """
+    events = queue.Queue()
+    workers = get_worker_count(workers)
+    log.info("Starting " + str(workers) + " worker threads")
+
+    jobs, duplicates = find_duplicates(jobs, indexes)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        submit = functools.partial(_submit, executor, events, keywords, rules, indexes or {}, atomic,
+                                   journal is not None, stats and stats.profile_folder, table)
+        yield from run_jobs(submit, jobs, events, IN_FLIGHT_PER_WORKER * workers, journal, duplicates, atomic,
+                            stats, controller, table)
+
+
+def _submit(executor, events, keywords, rules, indexes, atomic, digest, profile_folder, table, index, path):
+    executor.submit(run_job, events, index, path, keywords, rules, indexes.get(path), atomic, digest, time.time(),
+                    profile_folder, table)
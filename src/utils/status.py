@@ -0,0 +1,10 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Status of a file, small enough to be stored in a byte array
+NONE = 0
+PROCESSING = 1
+DONE = 2
+FAILED = 3
+IGNORED = 4
+UNCHANGED = 5  # values were already the requested ones : file not written
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import ctypes
+import heapq
+import multiprocessing
+
+from src.utils import status
+
+PENDING = 255  # not started yet, distinct from status.NONE which ends cancelled files
+CHUNK = 4096  # files compared at once when looking for changes
+
+
+class StatusTable:
+    """
+    Status, processing time and bytes written of each file of a batch, by index, in shared memory : worker threads and processes
+    write it directly, without any lock or message, and the GUI reads it when it repaints.
+
+    Each file is only written by the worker processing it. Its duration and size are written before its status, and a status is
+    a single byte : a reader seeing a final status also sees them.
+    Must be given to worker processes when they are started (e.g. as initializer argument), not with each job.
+    """
+
+    def __init__(self, size):
+        self.statuses = multiprocessing.RawArray(ctypes.c_ubyte, size)
+        self.durations = multiprocessing.RawArray(ctypes.c_double, size)  # s
+        self.written = multiprocessing.RawArray(ctypes.c_ulonglong, size)  # bytes
+        ctypes.memset(self.statuses, PENDING, size)
+
+    def __len__(self):
+        return len(self.statuses)
+
+    def start(self, index):
+        self.statuses[index] = status.PROCESSING
+
+    def finish(self, index, result, duration=0.0, written=0):
+        self.durations[index] = duration
+        self.written[index] = written
+        self.statuses[index] = result
+
+    def snapshot(self):
+        """
+        :return: bytes, status of each file
+        """
+        return bytes(self.statuses)
+
+    def changes(self, previous):
+        """
+        :param previous: snapshot of the last call, or b"" for the first one
+        :return: tuple (snapshot, list of (index, status) of files whose status has changed since previous)
+        """
+        current = self.snapshot()
+        changed = []
+        if current != previous:
+            previous = previous or bytes([PENDING]) * len(current)
+            for start in range(0, len(current), CHUNK):
+                end = start + CHUNK
+                if current[start:end] != previous[start:end]:
+                    changed.extend((index, current[index]) for index in range(start, min(end, len(current)))
+                                   if current[index] != previous[index])
+        return current, changed
+
+    @staticmethod
+    def finished(snapshot):
+        """
+        :return: number of files done, failed, unchanged or cancelled in snapshot
+        """
+        return len(snapshot) - snapshot.count(PENDING) - snapshot.count(status.PROCESSING)
+
+    def slowest(self, count):
+        """
+        :return: list of (duration, index) of the count files which took the longest, longest first
+        """
+        return heapq.nlargest(count, ((duration, index) for index, duration in enumerate(self.durations) if duration))
@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+import time
+
+from src.nif.processing import process_nif_file
+from src.nif.scan import find_nif_files, inspect_nif_file
+from src.utils import status
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # Optional : folders are polled instead
+    FileSystemEventHandler = object
+    Observer = None
+
+log = logging.getLogger(__name__)
+
+DEBOUNCE = 2.0  # s without any change before a file is processed : meshes are not written in one go
+POLL_INTERVAL = 1.0  # s, between two traversals of the folders when watchdog is not installed
+WAIT_STEP = 0.1  # s, between two checks for settled files
+
+
+class FolderWatcher:
+    """
+    Report .nif files of folders which are created or modified, once they have not changed for debounce seconds.
+    Changes are notified by the OS through watchdog when it is installed, otherwise folders are traversed at a regular
+    interval. Files already there when starting are not reported.
+    """
+
+    def __init__(self, folders, debounce=DEBOUNCE, interval=POLL_INTERVAL):
+        self.folders = folders
+        self.debounce = debounce
+        self.interval = interval
+        self.known = {}  # path -> (size, mtime_ns) when last reported, or when starting
+        self.pending = {}  # path -> ((size, mtime_ns), time.monotonic() of its last change)
+        self.lock = threading.Lock()
+        self.observer = None
+        self.last_poll = 0
+
+    def start(self):
+        self.known = self._snapshot()
+        self.last_poll = time.monotonic()
+        if Observer is not None:
+            self.observer = Observer()
+            for folder in self.folders:
+                self.observer.schedule(_EventHandler(self, folder), folder, recursive=True)
+            self.observer.start()
+            log.info("Watching " + ", ".join(self.folders) + " (" + str(len(self.known)) + " files)")
+        else:
+            log.info("Watching " + ", ".join(self.folders) + " (" + str(len(self.known)) + " files), every " +
+                     str(self.interval) + " s")
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+
+    def changes(self, timeout):
+        """
+        Wait at most timeout seconds for changed files to settle
+        :return: sorted list of paths created or modified since the last call, which have not changed since
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.observer is None and time.monotonic() - self.last_poll >= self.interval:
+                self._poll()
+            settled = self._settled()
+            if settled or time.monotonic() >= deadline:
+                return settled
+            time.sleep(WAIT_STEP)
+
+    def ignore(self, paths):
+        """
+        Forget changes made to paths since they were reported, e.g. by patching them
+        """
+        with self.lock:
+            for path in paths:
+                stat = _stat(path)
+                if stat is not None:
+                    self.known[path] = stat
+                self.pending.pop(path, None)
+
+    def touch(self, path, stat=None):
+        """
+        Record a change of path. Its debounce delay starts again if its size or modification time has changed.
+        """
+        stat = stat or _stat(path)
+        with self.lock:
+            if stat is None:
+                self.known.pop(path, None)
+                self.pending.pop(path, None)
+            elif stat == self.known.get(path):
+                self.pending.pop(path, None)
+            elif path not in self.pending or self.pending[path][0] != stat:
+                self.pending[path] = (stat, time.monotonic())
+
+    def _snapshot(self):
+        snapshot = {}
+        for folder in self.folders:
+            for path, dir_entry in find_nif_files(folder):
+                try:
+                    stat = dir_entry.stat()
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def _poll(self):
+        snapshot = self._snapshot()
+        self.last_poll = time.monotonic()
+        for path, stat in snapshot.items():
+            if self.known.get(path) != stat:
+                self.touch(path, stat)
+        with self.lock:
+            for path in set(self.known).difference(snapshot):
+                del self.known[path]
+                self.pending.pop(path, None)
+
+    def _settled(self):
+        settled = []
+        now = time.monotonic()
+        with self.lock:
+            for path, (stat, changed) in list(self.pending.items()):
+                if now - changed < self.debounce:
+                    continue
+                # Still being written if it has changed without any notification yet
+                current = _stat(path)
+                if current != stat:
+                    if current is None:
+                        del self.pending[path]
+                    else:
+                        self.pending[path] = (current, now)
+                    continue
+                del self.pending[path]
+                self.known[path] = stat
+                settled.append(path)
+        return sorted(settled)
+
+
+class _EventHandler(FileSystemEventHandler):
+    """ Forward watchdog events about .nif files to a FolderWatcher """
+
+    def __init__(self, watcher, folder):
+        super(_EventHandler, self).__init__()
+        self.watcher = watcher
+        self.folder = folder
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if path and path.endswith(".nif"):
+                self.watcher.touch(self._scan_path(path))
+
+    def _scan_path(self, path):
+        """
+        :return: path written the same way as by scan.find_nif_files, so that both refer to the same file
+        """
+        directory, name = os.path.split(os.path.relpath(path, self.folder))
+        return (os.path.join(self.folder, directory) if directory else self.folder) + "/" + name
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def watch_folders(folders, keywords, rules, stop, atomic=True, cache=None, debounce=DEBOUNCE,
+                  interval=POLL_INTERVAL):
+    """
+    Patch .nif files of folders as soon as they are created or modified (e.g. by a BodySlide batch build), until stop
+    is set. Only changed files are inspected, and only relevant ones are patched.
+    :param rules: RuleSet to apply
+    :param stop: threading.Event
+    :param atomic: replace files by new ones rather than modifying them in place, see process_nif_file
+    :param cache: ScanCache in which inspection results are saved, or None. Only used from the calling thread.
+    :return: generator of (path, ScanEntry, status), status being None if the file is not relevant
+    """
+    watcher = FolderWatcher(folders, debounce, interval)
+    watcher.start()
+    try:
+        while not stop.is_set():
+            paths = watcher.changes(interval)
+            if not paths:
+                continue
+            log.info(str(len(paths)) + " files changed")
+            for path in paths:
+                entry = inspect_nif_file(path, keywords)
+                result = None
+                if entry.result():
+                    try:
+                        result = process_nif_file(path, keywords, rules, entry.nif_index, atomic)
+                    except Exception:
+                        log.exception("Error while processing file : " + path)
+                        result = status.FAILED
+                # A patched file is not the one inspected anymore : it will be inspected again by the next scan
+                if cache is not None and result != status.DONE:
+                    stat = _stat(path)
+                    if stat is not None:
+                        cache.put(path, stat[0], stat[1], entry)
+                yield path, entry, result
+            # Files patched above must not be reported again
+            watcher.ignore(paths)
+    finally:
+        watcher.stop()
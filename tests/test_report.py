@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import unittest
+
+from src.nif.report import ShaderReport
+from src.nif.rules import FIELDS
+
+
+def shader(glossiness):
+    fields = {name: (0.0,) * (1 if field.components is None else len(field.components))
+              for name, field in FIELDS.items()}
+    fields["glossiness"] = (glossiness,)
+    return fields
+
+
+class ShaderReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.report = ShaderReport()
+        for index, glossiness in enumerate([100.0, 200.0, math.nan, 300.0, math.inf]):
+            self.report.add("file" + str(index) + ".nif", (b"Hands", [(index, shader(glossiness))]))
+
+    def test_histogram_skips_non_finite_values(self):
+        histogram = self.report.histogram("glossiness")
+        self.assertEqual(histogram[0][0], 100.0)
+        self.assertEqual(histogram[-1][1], 300.0)
+        self.assertEqual(sum(count for low, high, count in histogram), 3)
+        self.assertEqual(self.report.non_finite("glossiness"), 2)
+
+    def test_statistics_skip_non_finite_values(self):
+        glossiness = self.report.statistics()["Hands"]["glossiness"]
+        self.assertEqual(glossiness["count"], 5)
+        self.assertEqual(glossiness["non_finite"], 2)
+        self.assertEqual((glossiness["min"], glossiness["max"], glossiness["median"]), (100.0, 300.0, 200.0))
+
+    def test_summary_and_dict_with_nan(self):
+        self.assertIn("2 not finite", self.report.summary())
+        json.dumps(self.report.to_dict())
+
+    def test_only_nan(self):
+        report = ShaderReport()
+        report.add("file.nif", (b"Hands", [(0, shader(math.nan))]))
+        self.assertEqual(report.histogram("glossiness"), [])
+        self.assertIn("no finite value", report.summary())
+
+
+if __name__ == "__main__":
+    unittest.main()